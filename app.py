@@ -1,130 +1,674 @@
 ﻿# app.py - Multi-user Flask app with live database updates
-from flask import Flask, render_template, request, jsonify, send_file
-import sqlite3
+from flask import Flask, Response, g, render_template, request, jsonify
+from flask.cli import AppGroup
+import click
 import json
 import csv
+import atexit
+import base64
+import contextlib
+import heapq
 import io
-from datetime import datetime
+import itertools
+import logging
+import textwrap
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
 import os
-import threading
+import re
+
+from backup import BackupScheduler, checkpoint, restore_database, wal_size
+from heartbeat import parse_report
+from history import utc_timestamp
+from metrics import SIZE_BUCKETS, BackupMetrics, DatabaseMetrics, Registry
+from migrations import MIGRATIONS, migrate, rebuild_stats, schema_version, table_exists
+from sites import ReadAhead, Site, SiteRegistry, discover_sites, valid_site_name
 
 # Compute the absolute path to this file's directory
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 # Point the DB at an absolute path so Gunicorn always finds the same file
-DATABASE = os.path.join(BASE_DIR, 'computers.db')
+DATABASE = os.environ.get('COMPUTER_STATUS_DB', os.path.join(BASE_DIR, 'computers.db'))
+# Databases of the sites other than the default one, as <site>.db
+SITES_DIR = os.environ.get('COMPUTER_STATUS_SITES_DIR', os.path.join(BASE_DIR, 'sites'))
+
+# Logging - key=value messages under the computer_status logger. INFO covers
+# startup and errors; DEBUG adds a line per write. Set WARNING to silence it.
+LOG_LEVEL = os.environ.get('COMPUTER_STATUS_LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s %(message)s')
+log = logging.getLogger('computer_status')
+log.setLevel(LOG_LEVEL)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
 
-# Database configuration
-DATABASE_LOCK = threading.Lock()
-_db_initialized = False
-
-def ensure_db():
-    """Make sure the database exists and is seeded before serving any traffic."""
-    global _db_initialized
-    if not _db_initialized:
-        with DATABASE_LOCK:
-            if not _db_initialized:  # Double-check pattern
-                print(f"📊 Initializing database at: {DATABASE}")
-                init_database()
-                _db_initialized = True
-                print("✅ Database initialized!")
+# Database configuration - pragmas are applied once per pooled connection
+app.config['SQLITE_PRAGMAS'] = {
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,
+    'mmap_size': 268435456,
+    'busy_timeout': 20000,
+}
+app.config['SQLITE_POOL_SIZE'] = 16
 
-@app.before_request
-def before_request():
-    """Ensure database is initialized before any request."""
-    ensure_db()
-
-def get_db():
-    """Get database connection with proper configuration"""
-    conn = sqlite3.connect(DATABASE, timeout=20.0)
-    conn.row_factory = sqlite3.Row
-    conn.execute('PRAGMA journal_mode=WAL')  # Enable WAL mode for better concurrency
-    return conn
-
-def init_database():
-    """Initialize database with computers table and data"""
-    computers = [
-        'WXDKDSA10044W', 'WXDKDSA10173W', 'W7DKDSA05967', 'WXDKDSA10175W', 'WXDKDSA10309W',
-        'WXDKDSA05969W', 'WXDKDSA12991W', 'WXDKDSA10043W', 'WXDKDSA05973W', 'WXDKDSA13170W',
-        'WXDKDSA00128W', 'WXDKDSA00131W', 'WXDKDSA00356L', 'WXDKDSA11357L', 'WXDKDSA12403W',
-        'WXDKDSA12404W', 'WXDKDSA12406W', 'WXDKDSA12407W', 'W7DKDSA05770W', 'WXDKDSA00127W',
-        'WXDKDSA00130W', 'WXDKDSA13169W', 'WXDKDSA10063W', 'WXDKDSA10988W', 'WXDKDSA11760W',
-        'WXDKDSA00359L', 'WXDKDSA00355L', 'WXDKDSA05970W', 'WXDKDSA13189W', 'WXDKDSA13188W'
-    ]
-    
-    with DATABASE_LOCK:
-        conn = get_db()
-        try:
-            # Create computers table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS computers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    computer_id TEXT UNIQUE NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    notes TEXT DEFAULT '',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Create trigger to auto-update updated_at
-            conn.execute('''
-                CREATE TRIGGER IF NOT EXISTS update_computers_timestamp 
-                AFTER UPDATE ON computers
-                BEGIN
-                    UPDATE computers SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
-                END
-            ''')
-            
-            # Insert computers if they don't exist
-            for computer_id in computers:
-                conn.execute('''
-                    INSERT OR IGNORE INTO computers (computer_id, status) 
-                    VALUES (?, 'pending')
-                ''', (computer_id,))
-            
-            conn.commit()
-            print(f"✅ Database initialized with {len(computers)} computers")
+# Statements slower than this many seconds are logged and counted in /metrics
+# (None turns the slow query log off)
+app.config['SLOW_QUERY_THRESHOLD'] = 0.25
+
+# Computers loaded into a brand-new, empty database (one ID per line)
+app.config['SEED_FILE'] = os.path.join(BASE_DIR, 'seed_computers.txt')
+
+# Statuses a computer can be in - stats report a count for each of these
+app.config['STATUSES'] = ['pending', 'ready']
+
+# Exports stream this many rows per chunk
+app.config['EXPORT_CHUNK_SIZE'] = 500
+
+# Compression - exports, and JSON responses of at least COMPRESS_MIN_SIZE
+# bytes, are gzip/deflate encoded when the client accepts it
+app.config['GZIP_LEVEL'] = 6
+app.config['COMPRESS_MIN_SIZE'] = 500
+
+# Upper bound on computers touched by one /api/batch request
+app.config['BATCH_MAX_ITEMS'] = 10000
+
+# Pagination - rows per dashboard page, and the most a client may ask for
+app.config['DASHBOARD_PAGE_SIZE'] = 200
+app.config['MAX_PAGE_SIZE'] = 1000
+
+# Status history - events are written in batches by a background thread.
+# RETENTION_DAYS = None keeps history forever.
+app.config['HISTORY_FLUSH_INTERVAL'] = 1.0
+app.config['HISTORY_BATCH_SIZE'] = 1000
+app.config['HISTORY_RETENTION_DAYS'] = 365
+app.config['HISTORY_COMPACT_INTERVAL'] = 3600
+
+# Change feed configuration - how many changes a reconnecting client can catch
+# up on without a database read, how often an idle stream sends a keepalive
+# comment, and how often the database is polled for commits made by other
+# worker processes
+app.config['EVENTS_BUFFER_SIZE'] = 1000
+app.config['EVENTS_KEEPALIVE'] = 15
+app.config['EVENTS_POLL_INTERVAL'] = 0.5
+
+# ASGI mode (asgi.py) - threads for SQLite work behind the async routes, and
+# for requests handed through to this sync app
+app.config['ASYNC_DB_WORKERS'] = 8
+app.config['ASYNC_WSGI_WORKERS'] = 32
+
+# Agent heartbeats - buffered in memory and written to last_seen every
+# FLUSH_INTERVAL seconds. A computer is stale once it has not reported for
+# STALE_AFTER seconds. MAX_BATCH caps the reports in one NDJSON request.
+app.config['HEARTBEAT_FLUSH_INTERVAL'] = 1.0
+app.config['HEARTBEAT_STALE_AFTER'] = 300
+app.config['HEARTBEAT_MAX_BATCH'] = 10000
+app.config['HEARTBEAT_MAX_PENDING'] = 100000
+
+# Sites - each site has its own database file, pool and writer threads, so
+# writes on different sites never contend. DEFAULT_SITE lives in DATABASE and
+# is what the unprefixed routes serve; the others are every <site>.db in
+# SITES_DIR plus any named in COMPUTER_STATUS_SITES (created when missing),
+# served under /site/<site>/. SITE_WORKERS threads run cross-site queries.
+app.config['DEFAULT_SITE'] = 'main'
+app.config['SITES'] = [
+    name.strip() for name in os.environ.get('COMPUTER_STATUS_SITES', '').split(',') if name.strip()
+]
+app.config['SITE_WORKERS'] = 8
+
+# Backups - online snapshots of every site through the SQLite backup API,
+# copied BACKUP_PAGES pages at a time with a BACKUP_SLEEP second pause
+# between steps, taken every BACKUP_INTERVAL seconds (None: only on demand
+# with `flask fleet backup`) into BACKUP_DIR/<site>/, keeping the newest
+# BACKUP_KEEP.
+app.config['BACKUP_DIR'] = os.environ.get(
+    'COMPUTER_STATUS_BACKUP_DIR', os.path.join(os.path.dirname(os.path.abspath(DATABASE)), 'backups')
+)
+app.config['BACKUP_INTERVAL'] = int(os.environ.get('COMPUTER_STATUS_BACKUP_INTERVAL', 6 * 3600)) or None
+app.config['BACKUP_KEEP'] = 28
+app.config['BACKUP_PAGES'] = 1024
+app.config['BACKUP_SLEEP'] = 0.01
+
+# WAL checkpoints - every CHECKPOINT_INTERVAL seconds each site gets a
+# PASSIVE checkpoint (never blocks anyone); once its -wal file is over
+# WAL_MAX_BYTES a TRUNCATE one, which may hold writers back for at most
+# CHECKPOINT_BUSY_TIMEOUT seconds
+app.config['CHECKPOINT_INTERVAL'] = 60
+app.config['WAL_MAX_BYTES'] = 64 * 1024 * 1024
+app.config['CHECKPOINT_BUSY_TIMEOUT'] = 0.1
+
+# Metrics served at /metrics
+registry = Registry()
+db_metrics = DatabaseMetrics(registry, slow_query_threshold=app.config['SLOW_QUERY_THRESHOLD'])
+request_count = registry.counter(
+    'http_requests_total', 'HTTP requests by route, method and status code',
+    ['endpoint', 'method', 'status']
+)
+request_latency = registry.histogram(
+    'http_request_duration_seconds', 'Time to produce a response (headers for streamed ones)',
+    ['endpoint', 'method']
+)
+response_size = registry.histogram(
+    'http_response_bytes', 'Response body size as sent, after compression',
+    ['endpoint'], buckets=SIZE_BUCKETS
+)
+
+sites = SiteRegistry(workers=app.config['SITE_WORKERS'])
+atexit.register(sites.close)
+
+def load_seed_computers(path):
+    """Computer IDs from a seed file, skipping blank lines and # comments"""
+    with open(path, encoding='utf-8') as seed_file:
+        lines = (line.strip() for line in seed_file)
+        return [line for line in lines if line and not line.startswith('#')]
+
+def seed_database(conn):
+    """Load the seed computers into an empty database; returns how many"""
+    if conn.execute('SELECT 1 FROM computers LIMIT 1').fetchone():
+        return 0
+    computers = load_seed_computers(app.config['SEED_FILE'])
+    conn.executemany('''
+        INSERT OR IGNORE INTO computers (computer_id, status) 
+        VALUES (?, 'pending')
+    ''', ((computer_id,) for computer_id in computers))
+    return len(computers)
+
+def init_database(site, seed=False):
+    """Bring a site's schema up to date, seeding it if asked and still empty
+
+    Runs once per site and process at import time, not on the request path.
+    The write lock is only taken when there is something to do, so booting
+    workers and CLI commands do not queue behind each other or the app.
+    """
+    try:
+        applied, seeded = [], 0
+        with site.pool.read() as conn:
+            current = schema_version(conn) >= len(MIGRATIONS)
+            # An unmigrated database may not have a computers table yet
+            needs_seed = seed and (not current or not conn.execute('SELECT 1 FROM computers LIMIT 1').fetchone())
+            site.fts_enabled = table_exists(conn, 'computers_fts')
+        
+        if not current or needs_seed:
+            with site.pool.write() as conn:
+                applied = migrate(conn)
+                seeded = seed_database(conn) if seed else 0
+                site.fts_enabled = table_exists(conn, 'computers_fts')
+        
+        if applied:
+            log.info('database_migrated site=%s path=%s schema_version=%d applied=%s',
+                     site.name, site.path, len(MIGRATIONS), ','.join(applied))
+        if seeded:
+            log.info('database_seeded site=%s computers=%d', site.name, seeded)
             
-        except Exception as e:
-            print(f"❌ Database initialization error: {e}")
-            conn.rollback()
-        finally:
-            conn.close()
+    except Exception as e:
+        log.error('database_init_failed site=%s path=%s error=%r', site.name, site.path, e)
+        raise
+
+def load_changes(site, after):
+    """``(data version, payload)`` for everything committed after data version ``after``
+
+    The payload holds the changed rows and the current stats, or is None
+    when nothing changed (or ``after`` is None). Whichever process made the
+    commits, change_version records them.
+    """
+    with site.pool.read() as conn:
+        # Version, rows and stats from one snapshot
+        conn.execute('BEGIN')
+        version = fetch_version(conn)
+        if after is None or version <= after:
+            return version, None
+        # No ORDER BY: it would make SQLite walk the whole table in
+        # computer_id order instead of the few changed rows by change_version
+        rows = conn.execute(f'''
+            SELECT {ROW_COLUMNS} 
+            FROM computers 
+            WHERE change_version > ?
+        ''', (after,)).fetchall()
+        computers = sorted((dict(row) for row in rows), key=lambda row: row['computer_id'])
+        return version, {'computers': computers, 'stats': fetch_stats(conn)}
+
+def open_site(name, path):
+    return sites.add(Site(name, path, app.config, observer=db_metrics, load_changes=load_changes))
+
+def open_sites():
+    """Open the default site and every other configured or discovered one"""
+    default = app.config['DEFAULT_SITE']
+    init_database(open_site(default, DATABASE), seed=True)
+    
+    names = dict.fromkeys(discover_sites(SITES_DIR) + app.config['SITES'])
+    names.pop(default, None)
+    for name in names:
+        if not valid_site_name(name):
+            raise ValueError(f'Invalid site name: {name!r}')
+        os.makedirs(SITES_DIR, exist_ok=True)
+        init_database(open_site(name, os.path.join(SITES_DIR, f'{name}.db')))
+
+open_sites()
+
+backups = BackupScheduler(
+    sites,
+    app.config['BACKUP_DIR'],
+    backup_interval=app.config['BACKUP_INTERVAL'],
+    keep=app.config['BACKUP_KEEP'],
+    pages=app.config['BACKUP_PAGES'],
+    sleep=app.config['BACKUP_SLEEP'],
+    checkpoint_interval=app.config['CHECKPOINT_INTERVAL'],
+    wal_max_bytes=app.config['WAL_MAX_BYTES'],
+    truncate_busy_timeout=app.config['CHECKPOINT_BUSY_TIMEOUT'],
+    observer=BackupMetrics(registry)
+)
+# Started by the first request (see start_backups), so CLI commands never
+# run the schedule. Registered after sites.close, so it runs first.
+atexit.register(backups.stop)
+
+def default_site():
+    return sites.get(app.config['DEFAULT_SITE'])
+
+def current_site():
+    """The site the current request is for"""
+    return g.site
+
+def site_prefix():
+    """URL prefix of the current request's site, '' for the unprefixed routes"""
+    name = g.get('site_name')
+    return f'/site/{name}' if name else ''
+
+def site_route(rule, **options):
+    """Like app.route, also serving the view for any site under /site/<site>"""
+    def decorator(view):
+        app.add_url_rule(rule, view_func=view, **options)
+        app.add_url_rule(f'/site/<site>{rule}', view_func=view, **options)
+        return view
+    return decorator
+
+def count_statuses(conn):
+    """Per-status counts straight from the computers table (full scan)"""
+    rows = conn.execute('''
+        SELECT status, COUNT(*) as total FROM computers GROUP BY status
+    ''').fetchall()
+    return {row['status']: row['total'] for row in rows}
+
+def check_stats(conn):
+    """Statuses whose materialized count disagrees with the table, as {status: (stored, actual)}"""
+    stored = {
+        row['status']: row['total']
+        for row in conn.execute('SELECT status, total FROM status_counts')
+    }
+    actual = count_statuses(conn)
+    return {
+        status: (stored.get(status, 0), actual.get(status, 0))
+        for status in set(stored) | set(actual)
+        if stored.get(status, 0) != actual.get(status, 0)
+    }
+
+def fetch_version(conn):
+    """Current global data version"""
+    return conn.execute('SELECT version FROM data_version').fetchone()['version']
+
+def not_modified(etag):
+    """A 304 response if the client already holds ``etag``, otherwise None"""
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def fetch_stats(conn):
+    """Current fleet statistics as a plain dict, read from the materialized counts"""
+    statuses = {status: 0 for status in app.config['STATUSES']}
+    for row in conn.execute('SELECT status, total FROM status_counts WHERE total != 0'):
+        statuses[row['status']] = row['total']
+    
+    last_update = conn.execute('SELECT last_update FROM data_version').fetchone()['last_update']
+    return {
+        'total': sum(statuses.values()),
+        'ready': statuses.get('ready', 0),
+        'pending': statuses.get('pending', 0),
+        'statuses': statuses,
+        'last_update': last_update
+    }
+
+# Columns of a computer row as the API returns it
+API_COLUMNS = ('computer_id', 'status', 'notes', 'updated_at', 'version')
+ROW_COLUMNS = ', '.join(API_COLUMNS)
+
+# Assignments every UPDATE of status or notes makes in the same statement
+# (the trigger then only has to bump data_version)
+ROW_STAMP = '''updated_at = CURRENT_TIMESTAMP, 
+    version = version + 1, 
+    change_version = (SELECT version + 1 FROM data_version)'''
+
+def fetch_rows_by_id(conn, computer_ids):
+    """Rows for the given ids as {computer_id: row}; unknown ids are left out"""
+    found = {}
+    computer_ids = list(computer_ids)
+    # Stay well below SQLite's bound-parameter limit
+    for start in range(0, len(computer_ids), 500):
+        chunk = computer_ids[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(f'''
+            SELECT {ROW_COLUMNS} 
+            FROM computers 
+            WHERE computer_id IN ({placeholders})
+        ''', chunk):
+            found[row['computer_id']] = row
+    return found
+
+def expected_version(data):
+    """Row version the client based its change on, or None for an unconditional write
+
+    Taken from an If-Match header (``If-Match: "7"``) or a ``version`` field.
+    """
+    if request.if_match and not request.if_match.star_tag:
+        tags = request.if_match.as_set()
+        if len(tags) != 1 or not next(iter(tags)).isdigit():
+            raise ValueError('If-Match must be a single row version')
+        return int(next(iter(tags)))
+    version = data.get('version')
+    if version is None:
+        return None
+    if isinstance(version, bool) or not isinstance(version, int):
+        raise ValueError('version must be an integer')
+    return version
+
+def write_missed(conn, computer_id):
+    """Response for a conditional UPDATE that matched no row
+
+    409 with the current row when someone else changed it first, otherwise
+    the usual not-found error.
+    """
+    current = conn.execute(f'''
+        SELECT {ROW_COLUMNS} FROM computers WHERE computer_id = ?
+    ''', (computer_id,)).fetchone()
+    if current is None:
+        return jsonify({'success': False, 'error': 'Computer not found'})
+    return jsonify({
+        'success': False,
+        'error': 'Computer was changed by someone else',
+        'computer': dict(current),
+        'version': current['version']
+    }), 409
+
+def request_client():
+    """Who made the current request, for the status history"""
+    return request.headers.get('X-Client') or request.remote_addr
+
+def status_event(before, after, client, created_at=None):
+    """A status_events tuple for one row, or None if nothing changed"""
+    status_changed = before['status'] != after['status']
+    notes_changed = (before['notes'] or '') != (after['notes'] or '')
+    if not status_changed and not notes_changed:
+        return None
+    return (
+        before['computer_id'],
+        before['status'],
+        after['status'],
+        # Only keep the notes diff when the notes actually changed
+        before['notes'] if notes_changed else None,
+        after['notes'] if notes_changed else None,
+        created_at or utc_timestamp(),
+        client
+    )
+
+def record_history(pairs):
+    """Queue history events for (before, after) row pairs"""
+    client = request_client()
+    created_at = utc_timestamp()
+    events = [status_event(before, after, client, created_at) for before, after in pairs]
+    current_site().history.record(event for event in events if event)
+
+def publish_changes():
+    """Push just-committed changes to the current site's /api/events clients now
+
+    Commits from other processes reach them at the next poll instead.
+    """
+    current_site().watcher.poke()
+
+SORT_COLUMNS = ('computer_id', 'status', 'updated_at')
+
+def encode_cursor(row, sort):
+    """Opaque keyset cursor pointing just past ``row``"""
+    key = [row['computer_id']] if sort == 'computer_id' else [row[sort], row['computer_id']]
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Key values stored in a cursor from encode_cursor"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def notes_match_query(text):
+    """Turn free text into a safe FTS5 query: every word as a prefix term"""
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' for word in words)
+
+def like_contains(text):
+    """LIKE pattern (with ESCAPE '\\') matching ``text`` anywhere, wildcards in it taken literally"""
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+def query_computers(conn, q=None, match='contains', status=None, notes=None, since=None,
+                    sort='computer_id', order='asc', limit=None, cursor=None, fts=False):
+    """Filtered, sorted and optionally paginated computer rows
+
+    Returns ``(rows, next_cursor)``; next_cursor is None on the last page or
+    when no limit was given. ``fts`` searches notes through computers_fts.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+    if match not in ('contains', 'prefix'):
+        raise ValueError('match must be contains or prefix')
+    
+    clauses = []
+    params = []
+    
+    if q:
+        if match == 'prefix':
+            # Case-sensitive range scan on the computer_id index
+            where, where_params = computer_filter_clause({'prefix': q})
+            clauses.append(where)
+            params.extend(where_params)
+        else:
+            clauses.append("computer_id LIKE ? ESCAPE '\\'")
+            params.append(like_contains(q))
+    if status:
+        clauses.append('status = ?')
+        params.append(status)
+    if notes:
+        # Text without any word characters has nothing for FTS to match on
+        match_query = notes_match_query(notes) if fts else None
+        if match_query:
+            clauses.append('id IN (SELECT rowid FROM computers_fts WHERE computers_fts MATCH ?)')
+            params.append(match_query)
+        else:
+            clauses.append("notes LIKE ? ESCAPE '\\'")
+            params.append(like_contains(notes))
+    if since is not None:
+        clauses.append('change_version > ?')
+        params.append(since)
+    
+    key_columns = ['computer_id'] if sort == 'computer_id' else [sort, 'computer_id']
+    if cursor:
+        key = decode_cursor(cursor)
+        if not isinstance(key, list) or len(key) != len(key_columns):
+            raise ValueError('Invalid cursor')
+        comparison = '>' if order == 'asc' else '<'
+        clauses.append(f"({', '.join(key_columns)}) {comparison} ({', '.join('?' * len(key))})")
+        params.extend(key)
+    
+    sql = f'SELECT {ROW_COLUMNS} FROM computers'
+    if since is not None:
+        # Left to itself SQLite walks the sort order's index over the whole
+        # table; a delta is usually a handful of rows, cheaper to sort
+        sql += ' INDEXED BY idx_computers_change_version'
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += ' ORDER BY ' + ', '.join(f'{column} {order.upper()}' for column in key_columns)
+    if limit is not None:
+        # One extra row tells us whether there is another page
+        sql += ' LIMIT ?'
+        params.append(limit + 1)
+    
+    rows = conn.execute(sql, params).fetchall()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1], sort)
+    return rows, next_cursor
 
-@app.route('/')
+def computer_query_args(args):
+    """query_computers keyword arguments from request query parameters"""
+    limit = args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+    return {
+        'q': args.get('q') or None,
+        'match': args.get('match', 'contains'),
+        'status': args.get('status') or None,
+        'notes': args.get('notes') or None,
+        'since': args.get('since', type=int),
+        'sort': args.get('sort', 'computer_id'),
+        'order': args.get('order', 'asc'),
+        'limit': limit,
+        'cursor': args.get('cursor') or None
+    }
+
+def metrics_endpoint():
+    """Route pattern for metric labels, so path parameters do not add series"""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def count_streamed_bytes(chunks, endpoint):
+    """Pass a streamed body through, recording its size once it is finished"""
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        response_size.observe(sent, endpoint=endpoint)
+
+# zlib window bits for each Content-Encoding (HTTP "deflate" is the zlib format)
+COMPRESSION_WBITS = {'gzip': 31, 'deflate': 15}
+
+def negotiate_encoding(accept_encodings):
+    """'gzip' or 'deflate' if the client accepts one (gzip preferred), else None"""
+    return accept_encodings.best_match(tuple(COMPRESSION_WBITS))
+
+def compress_stream(chunks, encoding):
+    """Compress a stream of bytes chunk by chunk"""
+    compressor = zlib.compressobj(app.config['GZIP_LEVEL'], zlib.DEFLATED, COMPRESSION_WBITS[encoding])
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def compress_response(response, accept_encodings):
+    """Encode a complete JSON response with gzip or deflate when it is worth it"""
+    if (response.is_streamed or response.mimetype != 'application/json'
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    
+    data = response.get_data()
+    encoding = negotiate_encoding(accept_encodings)
+    if encoding is None or len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    
+    compressor = zlib.compressobj(app.config['GZIP_LEVEL'], zlib.DEFLATED, COMPRESSION_WBITS[encoding])
+    response.set_data(compressor.compress(data) + compressor.flush())
+    response.headers['Content-Encoding'] = encoding
+    # Same content, different bytes: a strong ETag would no longer be true
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+@app.url_value_preprocessor
+def pull_site(endpoint, values):
+    # Views never see the site argument; they use current_site()
+    g.site_name = values.pop('site', None) if values else None
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def start_backups():
+    # Only processes that serve requests run the backup schedule
+    backups.start()
+
+# Registered after the timer so unknown sites are still measured
+@app.before_request
+def resolve_site():
+    name = g.site_name or app.config['DEFAULT_SITE']
+    g.site = sites.get(name)
+    if g.site is None:
+        return jsonify({'success': False, 'error': f'Unknown site: {name}'}), 404
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = metrics_endpoint()
+    elapsed = time.perf_counter() - g.request_started
+    request_latency.observe(elapsed, endpoint=endpoint, method=request.method)
+    request_count.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if response.is_streamed:
+        response.response = count_streamed_bytes(response.response, endpoint)
+    else:
+        response_size.observe(response.content_length or 0, endpoint=endpoint)
+    return response
+
+# Registered after the metrics hook so it runs first and sizes are as sent
+@app.after_request
+def compress_json(response):
+    return compress_response(response, request.accept_encodings)
+
+@site_route('/')
 def index():
     """Main dashboard - shows current status from database"""
-    with DATABASE_LOCK:
-        conn = get_db()
-        try:
-            computers = conn.execute('''
-                SELECT computer_id, status, notes, updated_at 
-                FROM computers 
-                ORDER BY computer_id
-            ''').fetchall()
+    site = current_site()
+    try:
+        with site.pool.read() as conn:
+            # The rows and the data version come from one snapshot, so the
+            # stream picks up exactly where the page leaves off
+            conn.execute('BEGIN')
+            version = fetch_version(conn)
+            event_seq = version
+            etag = f'page-{version}'
+            cached = not_modified(etag)
+            if cached:
+                return cached
+            
+            # Only the first page is rendered; the rest loads on demand
+            page_size = app.config['DASHBOARD_PAGE_SIZE']
+            computers, next_cursor = query_computers(conn, limit=page_size, fts=site.fts_enabled)
             
             # Get statistics
-            stats = conn.execute('''
-                SELECT 
-                    COUNT(*) as total,
-                    SUM(CASE WHEN status = 'ready' THEN 1 ELSE 0 END) as ready,
-                    SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending
-                FROM computers
-            ''').fetchone()
+            stats = fetch_stats(conn)
             
-        except Exception as e:
-            print(f"❌ Database query error: {e}")
-            computers = []
-            stats = {'total': 0, 'ready': 0, 'pending': 0}
-        finally:
-            conn.close()
+    except Exception as e:
+        log.error('dashboard_query_failed site=%s error=%r', site.name, e)
+        computers = []
+        next_cursor = None
+        page_size = app.config['DASHBOARD_PAGE_SIZE']
+        stats = {'total': 0, 'ready': 0, 'pending': 0}
+        etag = None
+        event_seq = None
     
-    return render_template('dashboard.html', computers=computers, stats=stats)
+    response = app.make_response(
+        render_template('dashboard.html', computers=computers, stats=stats, event_seq=event_seq,
+                        next_cursor=next_cursor, page_size=page_size, site=site.name,
+                        site_prefix=site_prefix(), site_names=sites.names())
+    )
+    if etag:
+        # Let browsers revalidate instead of re-downloading an unchanged page
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-@app.route('/api/toggle_status', methods=['POST'])
+@site_route('/api/toggle_status', methods=['POST'])
 def toggle_status():
     """Toggle computer status in database"""
     try:
@@ -134,90 +678,94 @@ def toggle_status():
         if not computer_id:
             return jsonify({'success': False, 'error': 'Computer ID required'})
         
-        with DATABASE_LOCK:
-            conn = get_db()
-            try:
-                # Get current status
-                current = conn.execute('''
-                    SELECT status FROM computers WHERE computer_id = ?
+        try:
+            expected = expected_version(data)
+            with current_site().pool.write() as conn:
+                # The old row is only needed for the history; BEGIN
+                # IMMEDIATE keeps this read and the update atomic
+                before = conn.execute('''
+                    SELECT computer_id, status, notes FROM computers WHERE computer_id = ?
                 ''', (computer_id,)).fetchone()
                 
-                if not current:
-                    return jsonify({'success': False, 'error': 'Computer not found'})
-                
-                # Toggle status
-                new_status = 'ready' if current['status'] == 'pending' else 'pending'
-                
-                # Update database
-                conn.execute('''
+                # With an expected version the toggle only applies if
+                # nobody changed the row in the meantime
+                rows = conn.execute(f'''
                     UPDATE computers 
-                    SET status = ? 
-                    WHERE computer_id = ?
-                ''', (new_status, computer_id))
+                    SET status = CASE status WHEN 'pending' THEN 'ready' ELSE 'pending' END, 
+                        {ROW_STAMP} 
+                    WHERE computer_id = ? AND (? IS NULL OR version = ?) 
+                    RETURNING {ROW_COLUMNS}
+                ''', (computer_id, expected, expected)).fetchall()
                 
-                conn.commit()
-                
-                print(f"✅ {computer_id} status changed to {new_status}")
-                
-                return jsonify({
-                    'success': True, 
-                    'new_status': new_status,
-                    'computer_id': computer_id,
-                    'timestamp': datetime.now().isoformat()
-                })
-                
-            except Exception as e:
-                print(f"❌ Toggle status error: {e}")
-                conn.rollback()
-                return jsonify({'success': False, 'error': str(e)})
-            finally:
-                conn.close()
+                if not rows:
+                    return write_missed(conn, computer_id)
+            
+            changed = dict(rows[0])
+            new_status = changed['status']
+            publish_changes()
+            record_history([(before, changed)])
+            log.debug('status_changed computer_id=%s status=%s', computer_id, new_status)
+            
+            return jsonify({
+                'success': True, 
+                'new_status': new_status,
+                'computer_id': computer_id,
+                'version': changed['version'],
+                'timestamp': datetime.now().isoformat()
+            })
+            
+        except Exception as e:
+            log.error('toggle_status_failed computer_id=%s error=%r', computer_id, e)
+            return jsonify({'success': False, 'error': str(e)})
                 
     except Exception as e:
-        print(f"❌ API error: {e}")
+        log.error('toggle_status_request_failed error=%r', e)
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/bulk_update', methods=['POST'])
+@site_route('/api/bulk_update', methods=['POST'])
 def bulk_update():
     """Update all computers to specified status"""
     try:
         data = request.get_json()
         status = data.get('status')
         
-        if status not in ['ready', 'pending']:
+        if status not in app.config['STATUSES']:
             return jsonify({'success': False, 'error': 'Invalid status'})
         
-        with DATABASE_LOCK:
-            conn = get_db()
-            try:
-                # Update all computers
-                result = conn.execute('''
-                    UPDATE computers SET status = ?
-                ''', (status,))
-                
-                conn.commit()
-                
-                print(f"✅ Bulk update: {result.rowcount} computers set to {status}")
+        try:
+            with current_site().pool.write() as conn:
+                # Rows that will actually change, for the history
+                before = conn.execute('''
+                    SELECT computer_id, status, notes FROM computers WHERE status IS NOT ?
+                ''', (status,)).fetchall()
                 
-                return jsonify({
-                    'success': True, 
-                    'status': status,
-                    'updated_count': result.rowcount,
-                    'timestamp': datetime.now().isoformat()
-                })
+                # Only rows not already in that status, so other clients'
+                # versions of the rest stay valid
+                result = conn.execute(f'''
+                    UPDATE computers SET status = ?, {ROW_STAMP} 
+                    WHERE status IS NOT ?
+                ''', (status, status))
                 
-            except Exception as e:
-                print(f"❌ Bulk update error: {e}")
-                conn.rollback()
-                return jsonify({'success': False, 'error': str(e)})
-            finally:
-                conn.close()
+            publish_changes()
+            record_history((row, {'status': status, 'notes': row['notes']}) for row in before)
+            log.debug('bulk_update status=%s computers=%d', status, result.rowcount)
+            
+            return jsonify({
+                'success': True, 
+                'status': status,
+                'updated_count': result.rowcount,
+                'timestamp': datetime.now().isoformat()
+            })
+            
+        except Exception as e:
+            log.error('bulk_update_failed status=%s error=%r', status, e)
+            return jsonify({'success': False, 'error': str(e)})
                 
     except Exception as e:
-        print(f"❌ Bulk update API error: {e}")
+        log.error('bulk_update_request_failed error=%r', e)
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/update_notes', methods=['POST'])
+@site_route('/api/update_notes', methods=['POST'])
 def update_notes():
     """Update notes for a computer"""
     try:
@@ -228,208 +776,1012 @@ def update_notes():
         if not computer_id:
             return jsonify({'success': False, 'error': 'Computer ID required'})
         
-        with DATABASE_LOCK:
-            conn = get_db()
-            try:
-                # Update notes
-                result = conn.execute('''
-                    UPDATE computers 
-                    SET notes = ? 
-                    WHERE computer_id = ?
-                ''', (notes, computer_id))
+        try:
+            expected = expected_version(data)
+            with current_site().pool.write() as conn:
+                # The old notes are only needed for the history; BEGIN
+                # IMMEDIATE keeps this read and the update atomic
+                before = conn.execute('''
+                    SELECT computer_id, status, notes FROM computers WHERE computer_id = ?
+                ''', (computer_id,)).fetchone()
                 
-                if result.rowcount == 0:
-                    return jsonify({'success': False, 'error': 'Computer not found'})
+                rows = conn.execute(f'''
+                    UPDATE computers 
+                    SET notes = ?, {ROW_STAMP} 
+                    WHERE computer_id = ? AND (? IS NULL OR version = ?) 
+                    RETURNING {ROW_COLUMNS}
+                ''', (notes, computer_id, expected, expected)).fetchall()
                 
-                conn.commit()
+                if not rows:
+                    return write_missed(conn, computer_id)
+            
+            changed = dict(rows[0])
+            publish_changes()
+            record_history([(before, changed)])
+            log.debug('notes_updated computer_id=%s', computer_id)
+            
+            return jsonify({
+                'success': True,
+                'computer_id': computer_id,
+                'version': changed['version'],
+                'timestamp': datetime.now().isoformat()
+            })
+            
+        except Exception as e:
+            log.error('update_notes_failed computer_id=%s error=%r', computer_id, e)
+            return jsonify({'success': False, 'error': str(e)})
                 
-                print(f"✅ Notes updated for {computer_id}")
+    except Exception as e:
+        log.error('update_notes_request_failed error=%r', e)
+        return jsonify({'success': False, 'error': str(e)})
+
+BATCH_OPERATIONS = ('set_status', 'toggle', 'set_notes')
+
+def computer_filter_clause(filters):
+    """WHERE clause and params for a {prefix, status} computer filter"""
+    clauses = []
+    params = []
+    prefix = filters.get('prefix')
+    if prefix:
+        # A range instead of LIKE so the computer_id index is used
+        clauses.append('computer_id >= ? AND computer_id < ?')
+        params.extend([prefix, prefix + '\uffff'])
+    status = filters.get('status')
+    if status:
+        clauses.append('status = ?')
+        params.append(status)
+    return (' AND '.join(clauses) or '1'), params
+
+def resolve_batch_targets(conn, operation):
+    """Computer ids an operation applies to, in request order, without duplicates"""
+    if operation['op'] == 'set_notes':
+        return list(operation['notes'])
+    if 'filter' in operation:
+        where, params = computer_filter_clause(operation['filter'])
+        rows = conn.execute(f'''
+            SELECT computer_id FROM computers WHERE {where} ORDER BY computer_id
+        ''', params).fetchall()
+        return [row['computer_id'] for row in rows]
+    return list(dict.fromkeys(operation['computer_ids']))
+
+def validate_batch_operation(operation):
+    """Error message for a malformed batch operation, or None"""
+    if not isinstance(operation, dict) or operation.get('op') not in BATCH_OPERATIONS:
+        return f"op must be one of {', '.join(BATCH_OPERATIONS)}"
+    op = operation['op']
+    if op == 'set_notes':
+        if not isinstance(operation.get('notes'), dict):
+            return 'set_notes needs a notes object of {computer_id: notes}'
+        return None
+    if op == 'set_status' and operation.get('status') not in app.config['STATUSES']:
+        return 'Invalid status'
+    if 'filter' in operation:
+        filters = operation['filter']
+        if not isinstance(filters, dict) or not (filters.get('prefix') or filters.get('status')):
+            return 'filter needs a prefix and/or status'
+        return None
+    if not isinstance(operation.get('computer_ids'), list):
+        return f'{op} needs computer_ids or a filter'
+    return None
+
+def apply_batch_operation(conn, operation, computer_ids):
+    """Run one batch operation with executemany; returns the affected row count"""
+    op = operation['op']
+    if op == 'set_status':
+        result = conn.executemany(f'''
+            UPDATE computers SET status = ?, {ROW_STAMP} WHERE computer_id = ?
+        ''', ((operation['status'], computer_id) for computer_id in computer_ids))
+    elif op == 'toggle':
+        result = conn.executemany(f'''
+            UPDATE computers 
+            SET status = CASE WHEN status = 'pending' THEN 'ready' ELSE 'pending' END, 
+                {ROW_STAMP} 
+            WHERE computer_id = ?
+        ''', ((computer_id,) for computer_id in computer_ids))
+    else:
+        notes = operation['notes']
+        result = conn.executemany(f'''
+            UPDATE computers SET notes = ?, {ROW_STAMP} WHERE computer_id = ?
+        ''', ((notes[computer_id] or '', computer_id) for computer_id in computer_ids))
+    return result.rowcount
+
+@site_route('/api/batch', methods=['POST'])
+def batch_update():
+    """Apply a list of status/notes operations in a single transaction
+
+    Each operation is one of::
+
+        {"op": "set_status", "status": "ready", "computer_ids": [...]}
+        {"op": "toggle", "computer_ids": [...]}
+        {"op": "set_notes", "notes": {"<computer_id>": "<notes>", ...}}
+
+    set_status and toggle accept ``"filter": {"prefix": ..., "status": ...}``
+    in place of computer_ids. Either every operation commits or none does.
+    """
+    try:
+        data = request.get_json()
+        operations = data.get('operations')
+        
+        if not isinstance(operations, list) or not operations:
+            return jsonify({'success': False, 'error': 'operations list required'})
+        
+        for index, operation in enumerate(operations):
+            error = validate_batch_operation(operation)
+            if error:
+                return jsonify({'success': False, 'error': f'Operation {index}: {error}'})
+        
+        try:
+            with current_site().pool.write() as conn:
+                results = []
+                touched = {}
+                history_pairs = []
+                total_items = 0
                 
-                return jsonify({
-                    'success': True,
-                    'computer_id': computer_id,
-                    'timestamp': datetime.now().isoformat()
-                })
+                for operation in operations:
+                    computer_ids = resolve_batch_targets(conn, operation)
+                    total_items += len(computer_ids)
+                    if total_items > app.config['BATCH_MAX_ITEMS']:
+                        raise ValueError(f"Batch touches more than {app.config['BATCH_MAX_ITEMS']} computers")
+                    
+                    before = fetch_rows_by_id(conn, computer_ids)
+                    updated_count = apply_batch_operation(conn, operation, computer_ids)
+                    
+                    # Per-item outcome, as of this operation
+                    rows = fetch_rows_by_id(conn, computer_ids)
+                    history_pairs.extend((before[computer_id], row) for computer_id, row in rows.items())
+                    items = []
+                    for computer_id in computer_ids:
+                        row = rows.get(computer_id)
+                        if row is None:
+                            items.append({'computer_id': computer_id, 'success': False, 'error': 'Computer not found'})
+                        else:
+                            items.append({'computer_id': computer_id, 'success': True, 'status': row['status']})
+                            touched[computer_id] = True
+                    
+                    results.append({
+                        'op': operation['op'],
+                        'updated_count': updated_count,
+                        'items': items
+                    })
                 
-            except Exception as e:
-                print(f"❌ Update notes error: {e}")
-                conn.rollback()
-                return jsonify({'success': False, 'error': str(e)})
-            finally:
-                conn.close()
+            publish_changes()
+            record_history(history_pairs)
+            log.debug('batch_update operations=%d computers=%d', len(operations), len(touched))
+            
+            return jsonify({
+                'success': True,
+                'results': results,
+                'updated_count': len(touched),
+                'timestamp': datetime.now().isoformat()
+            })
+            
+        except Exception as e:
+            log.error('batch_update_failed error=%r', e)
+            return jsonify({'success': False, 'error': str(e)})
                 
     except Exception as e:
-        print(f"❌ Update notes API error: {e}")
+        log.error('batch_update_request_failed error=%r', e)
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/stats')
+HISTORY_BUCKETS = {
+    'minute': '%Y-%m-%d %H:%M:00',
+    'hour': '%Y-%m-%d %H:00:00',
+    'day': '%Y-%m-%d'
+}
+
+@site_route('/api/history/<computer_id>')
+def get_history(computer_id):
+    """Status/notes change history for one computer, newest first
+
+    Events are written in the background, so the last second or so of
+    changes may not be visible yet. Page with ``limit`` and ``before=<id>``.
+    """
+    try:
+        limit = max(1, min(request.args.get('limit', 100, type=int), app.config['MAX_PAGE_SIZE']))
+        before = request.args.get('before', type=int)
+        
+        with current_site().pool.read() as conn:
+            sql = '''
+                SELECT id, computer_id, old_status, new_status, old_notes, new_notes, created_at, client 
+                FROM status_events 
+                WHERE computer_id = ?
+            '''
+            params = [computer_id]
+            if before is not None:
+                sql += ' AND id < ?'
+                params.append(before)
+            sql += ' ORDER BY id DESC LIMIT ?'
+            params.append(limit)
+            events = [dict(row) for row in conn.execute(sql, params)]
+        
+        return jsonify({
+            'success': True,
+            'computer_id': computer_id,
+            'events': events,
+            'next_before': events[-1]['id'] if len(events) == limit else None,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        log.error('history_request_failed computer_id=%s error=%r', computer_id, e)
+        return jsonify({'success': False, 'error': str(e)})
+
+@site_route('/api/history/throughput')
+def get_throughput():
+    """Status transitions per time bucket, e.g. machines made ready per hour
+
+    ``bucket`` is minute, hour or day; ``since``/``until`` limit the range
+    (UTC, 'YYYY-MM-DD HH:MM:SS'). Defaults to the last 7 days.
+    """
+    try:
+        bucket = request.args.get('bucket', 'hour')
+        if bucket not in HISTORY_BUCKETS:
+            return jsonify({'success': False, 'error': f"bucket must be one of {', '.join(HISTORY_BUCKETS)}"})
+        since = request.args.get('since') or utc_timestamp(datetime.now(timezone.utc) - timedelta(days=7))
+        until = request.args.get('until') or utc_timestamp()
+        
+        with current_site().pool.read() as conn:
+            rows = conn.execute('''
+                SELECT strftime(?, created_at) as bucket, new_status, COUNT(*) as total 
+                FROM status_events 
+                WHERE created_at >= ? AND created_at <= ? AND old_status IS NOT new_status
+                GROUP BY bucket, new_status 
+                ORDER BY bucket
+            ''', (HISTORY_BUCKETS[bucket], since, until)).fetchall()
+        
+        buckets = {}
+        for row in rows:
+            counts = buckets.setdefault(row['bucket'], {'bucket': row['bucket']})
+            counts[row['new_status']] = row['total']
+        
+        return jsonify({
+            'success': True,
+            'bucket': bucket,
+            'since': since,
+            'until': until,
+            'buckets': list(buckets.values()),
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        log.error('throughput_request_failed error=%r', e)
+        return jsonify({'success': False, 'error': str(e)})
+
+@site_route('/api/heartbeat', methods=['POST'])
+def heartbeat():
+    """Accept agent heartbeats: one JSON report, or NDJSON with one per line
+
+    A report is ``{"computer_id": ..., "state": ..., "timestamp": ...}``;
+    state and timestamp are optional. Reports are buffered in memory and
+    written to last_seen in batches, so no request waits on a commit.
+    Reports for unknown computers are dropped when the buffer is written.
+    """
+    try:
+        body = request.get_data(as_text=True)
+        if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            lines = [line for line in body.splitlines() if line.strip()]
+        else:
+            lines = [body]
+        
+        if len(lines) > app.config['HEARTBEAT_MAX_BATCH']:
+            return jsonify({
+                'success': False,
+                'error': f"At most {app.config['HEARTBEAT_MAX_BATCH']} reports per request"
+            })
+        
+        now = datetime.now(timezone.utc)
+        reports = []
+        errors = []
+        for line_number, line in enumerate(lines, start=1):
+            try:
+                reports.append(parse_report(json.loads(line), now))
+            except (ValueError, OverflowError, OSError) as e:
+                errors.append({'line': line_number, 'error': str(e)})
+        
+        accepted = current_site().heartbeats.record(reports)
+        if lines and not accepted:
+            return jsonify({
+                'success': False,
+                'error': 'No reports accepted',
+                'rejected': len(lines),
+                'errors': errors[:10]
+            })
+        
+        return jsonify({
+            'success': True,
+            'accepted': accepted,
+            'rejected': len(lines) - accepted,
+            'errors': errors[:10]
+        })
+        
+    except Exception as e:
+        log.error('heartbeat_request_failed error=%r', e)
+        return jsonify({'success': False, 'error': str(e)})
+
+@site_route('/api/heartbeat')
+def get_heartbeats():
+    """When each computer last reported in; ``stale=1`` lists only stale ones"""
+    try:
+        site = current_site()
+        cutoff = site.heartbeats.stale_cutoff()
+        stale_only = request.args.get('stale', type=int) == 1
+        
+        sql = 'SELECT computer_id, seen_at, state FROM last_seen'
+        params = []
+        if stale_only:
+            sql += ' WHERE seen_at < ?'
+            params.append(cutoff)
+        sql += ' ORDER BY computer_id'
+        
+        with site.pool.read() as conn:
+            rows = conn.execute(sql, params).fetchall()
+            stale_count = conn.execute('''
+                SELECT COUNT(*) FROM last_seen WHERE seen_at < ?
+            ''', (cutoff,)).fetchone()[0]
+        
+        return jsonify({
+            'success': True,
+            'computers': [
+                {
+                    'computer_id': row['computer_id'],
+                    'last_seen': row['seen_at'],
+                    'state': row['state'],
+                    'stale': row['seen_at'] < cutoff
+                }
+                for row in rows
+            ],
+            'stale_count': stale_count,
+            'stale_after': app.config['HEARTBEAT_STALE_AFTER'],
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        log.error('heartbeat_list_request_failed error=%r', e)
+        return jsonify({'success': False, 'error': str(e)})
+
+# The loaders below do the database work behind /api/stats and
+# /api/computers; asgi.py calls them from its executor as well.
+
+def load_stats(site, if_none_match):
+    """``(etag, stats)`` for a site's /api/stats; stats is None if the client's copy is current"""
+    with site.pool.read() as conn:
+        version = fetch_version(conn)
+        etag = f'stats-{version}'
+        if if_none_match.contains_weak(etag):
+            return etag, None
+        
+        stats = fetch_stats(conn)
+        
+    stats['version'] = version
+    stats['timestamp'] = datetime.now().isoformat()
+    return etag, stats
+
+def columnar_computers(rows):
+    """Column names plus one array per row, with status as an index into ``statuses``"""
+    statuses = list(app.config['STATUSES'])
+    codes = {status: code for code, status in enumerate(statuses)}
+    data = []
+    for computer_id, status, notes, updated_at, version in rows:
+        code = codes.get(status)
+        if code is None:
+            code = codes[status] = len(statuses)
+            statuses.append(status)
+        data.append([computer_id, code, notes, updated_at, version])
+    return {'columns': list(API_COLUMNS), 'statuses': statuses, 'rows': data}
+
+def load_computers(site, args, if_none_match):
+    """``(etag, payload)`` for a site's /api/computers; payload is None if the client's copy is current"""
+    query_args = computer_query_args(args)
+    since = query_args['since']
+    response_format = args.get('format', 'objects')
+    if response_format not in ('objects', 'columnar'):
+        raise ValueError('format must be objects or columnar')
+    
+    with site.pool.read() as conn:
+        # Read the version before the rows: a row committed in between is
+        # sent again next time rather than missed
+        version = fetch_version(conn)
+        etag = f'computers-{version}-{response_format}'
+        if if_none_match.contains_weak(etag):
+            return etag, None
+        
+        computers, next_cursor = query_computers(conn, fts=site.fts_enabled, **query_args)
+    
+    if response_format == 'columnar':
+        payload = columnar_computers(computers)
+    else:
+        payload = {'computers': [dict(comp) for comp in computers]}
+    
+    return etag, {
+        'success': True,
+        **payload,
+        'format': response_format,
+        'next_cursor': next_cursor,
+        'version': version,
+        'delta': since is not None,
+        'timestamp': datetime.now().isoformat()
+    }
+
+@site_route('/api/stats')
 def get_stats():
     """Get current statistics from database"""
     try:
-        with DATABASE_LOCK:
-            conn = get_db()
-            try:
-                stats = conn.execute('''
-                    SELECT 
-                        COUNT(*) as total,
-                        SUM(CASE WHEN status = 'ready' THEN 1 ELSE 0 END) as ready,
-                        SUM(CASE WHEN status = 'pending' THEN 1 ELSE 0 END) as pending,
-                        MAX(updated_at) as last_update
-                    FROM computers
-                ''').fetchone()
-                
-                return jsonify({
-                    'total': stats['total'],
-                    'ready': stats['ready'],
-                    'pending': stats['pending'],
-                    'last_update': stats['last_update'],
-                    'timestamp': datetime.now().isoformat()
-                })
-                
-            except Exception as e:
-                print(f"❌ Stats query error: {e}")
-                return jsonify({'success': False, 'error': str(e)})
-            finally:
-                conn.close()
+        etag, stats = load_stats(current_site(), request.if_none_match)
+        if stats is None:
+            return not_modified(etag)
+        
+        response = jsonify(stats)
+        response.set_etag(etag)
+        return response
                 
     except Exception as e:
-        print(f"❌ Stats API error: {e}")
+        log.error('stats_request_failed error=%r', e)
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/computers')
+@site_route('/api/computers')
 def get_computers():
-    """Get all computers with current status - for AJAX refresh"""
+    """Get computers with current status - for AJAX refresh
+
+    Query parameters (all optional):
+
+    - ``since=<version>``: only rows changed after that data version
+    - ``q``: computer_id search; ``match=prefix`` for an indexed prefix
+      search instead of the default substring match
+    - ``status``: exact status
+    - ``notes``: full-text search over notes
+    - ``sort`` (computer_id, status, updated_at) and ``order`` (asc, desc)
+    - ``limit`` and ``cursor``: keyset pagination; pass back ``next_cursor``
+    - ``format=columnar``: ``columns`` plus one array per row in ``rows``,
+      with status as an index into ``statuses``, instead of one object per row
+    """
     try:
-        with DATABASE_LOCK:
-            conn = get_db()
-            try:
-                computers = conn.execute('''
-                    SELECT computer_id, status, notes, updated_at 
-                    FROM computers 
-                    ORDER BY computer_id
-                ''').fetchall()
-                
-                computers_list = []
-                for comp in computers:
-                    computers_list.append({
-                        'computer_id': comp['computer_id'],
-                        'status': comp['status'],
-                        'notes': comp['notes'],
-                        'updated_at': comp['updated_at']
-                    })
-                
-                return jsonify({
-                    'success': True,
-                    'computers': computers_list,
-                    'timestamp': datetime.now().isoformat()
-                })
+        etag, payload = load_computers(current_site(), request.args, request.if_none_match)
+        if payload is None:
+            return not_modified(etag)
+        
+        response = jsonify(payload)
+        response.set_etag(etag)
+        return response
                 
-            except Exception as e:
-                print(f"❌ Get computers error: {e}")
-                return jsonify({'success': False, 'error': str(e)})
-            finally:
-                conn.close()
+    except Exception as e:
+        log.error('computers_request_failed error=%r', e)
+        return jsonify({'success': False, 'error': str(e)})
+
+def merge_stats(site_stats):
+    """Fleet-wide statistics from per-site fetch_stats results"""
+    statuses = {status: 0 for status in app.config['STATUSES']}
+    last_updates = []
+    for stats in site_stats:
+        for status, total in stats['statuses'].items():
+            statuses[status] = statuses.get(status, 0) + total
+        if stats['last_update']:
+            last_updates.append(stats['last_update'])
+    return {
+        'total': sum(statuses.values()),
+        'ready': statuses.get('ready', 0),
+        'pending': statuses.get('pending', 0),
+        'statuses': statuses,
+        'last_update': max(last_updates, default=None)
+    }
+
+def read_site_stats(site):
+    """``(data version, stats)`` for one site"""
+    with site.pool.read() as conn:
+        return fetch_version(conn), fetch_stats(conn)
+
+def load_site_stats(if_none_match):
+    """``(etag, payload)`` for /api/sites, every site read in parallel"""
+    results = sites.map(read_site_stats)
+    # Changes whenever any site's data version does
+    versions = ','.join(f'{name}:{version}' for name, (version, _) in results.items())
+    etag = f'sites-{zlib.crc32(versions.encode("utf-8")):08x}'
+    if if_none_match.contains_weak(etag):
+        return etag, None
+    
+    per_site = {name: dict(stats, version=version) for name, (version, stats) in results.items()}
+    return etag, {
+        'success': True,
+        'default_site': app.config['DEFAULT_SITE'],
+        'sites': per_site,
+        'totals': merge_stats(per_site.values()),
+        'timestamp': datetime.now().isoformat()
+    }
+
+@app.route('/api/sites')
+def get_sites():
+    """Statistics for every site, plus fleet-wide totals"""
+    try:
+        etag, payload = load_site_stats(request.if_none_match)
+        if payload is None:
+            return not_modified(etag)
+        
+        response = jsonify(payload)
+        response.set_etag(etag)
+        return response
                 
     except Exception as e:
-        print(f"❌ Get computers API error: {e}")
+        log.error('sites_request_failed error=%r', e)
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/export/csv')
+def format_event(seq, event, data):
+    """Serialize one Server-Sent Events message"""
+    lines = []
+    if seq is not None:
+        lines.append(f'id: {seq}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+def stream_position(site, last_id):
+    """``(data version, notice number)`` a stream starts after
+
+    The data version comes from Last-Event-ID or ?last_event_id, which any
+    worker process can resume from.
+    """
+    site.watcher.start()
+    feed = site.feed
+    try:
+        after = int(last_id) if last_id else feed.seq
+    except ValueError:
+        after = feed.seq
+    return after, feed.notice_seq
+
+def catch_up(site, after):
+    """Changes since data version ``after`` read from the database, as ChangeFeed.since returns them
+
+    None when ``after`` is ahead of the database (a restored or replaced
+    one), which the client can only recover from by reloading.
+    """
+    version, payload = load_changes(site, after)
+    if version < after:
+        return None
+    return [] if payload is None else [(version, payload)]
+
+def stream_message(feed, after, notices_after, changes, notices):
+    """SSE text for what ChangeFeed.wait returned, and the new stream positions"""
+    text = ''.join(format_event(None, 'change', payload) for _, payload in notices)
+    if notices:
+        notices_after = notices[-1][0]
+    if changes is None:
+        after = feed.seq
+        return after, notices_after, text + format_event(after, 'resync', {'seq': after})
+    if changes:
+        after = changes[-1][0]
+        text += ''.join(format_event(seq, 'change', payload) for seq, payload in changes)
+    return after, notices_after, text or ': keepalive\n\n'
+
+@site_route('/api/events')
+def event_stream():
+    """Server-Sent Events stream of committed changes"""
+    # Browsers send Last-Event-ID on reconnect; the first connect passes the
+    # data version the page was rendered at as a query parameter instead
+    site = current_site()
+    feed = site.feed
+    after, notices_after = stream_position(
+        site, request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    )
+    keepalive = app.config['EVENTS_KEEPALIVE']
+    
+    def generate():
+        nonlocal after, notices_after
+        yield 'retry: 3000\n\n'
+        changes, notices = feed.since(after, notices_after)
+        while True:
+            if changes is None:
+                # Not in this process's buffer - too old, or written by
+                # another worker this one has not polled yet
+                changes = catch_up(site, after)
+            after, notices_after, message = stream_message(feed, after, notices_after, changes, notices)
+            yield message
+            changes, notices = feed.wait(after, notices_after, timeout=keepalive)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics in the text exposition format"""
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def export_cursor(conn, site_name=None):
+    """Cursor over every computer in export order, each row tagged with ``site_name``"""
+    return conn.execute('''
+        SELECT ? as site, computer_id, status, notes, updated_at 
+        FROM computers 
+        ORDER BY computer_id
+    ''', (site_name,))
+
+def iter_export_rows(conn, chunk_size):
+    """Yield export rows in chunks of ``chunk_size`` from an open cursor"""
+    cursor = export_cursor(conn)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+def stream_export(render):
+    """Run ``render(total, chunks)`` against one read snapshot, yielding its text
+
+    The snapshot is an ordinary WAL read transaction, so writers carry on
+    while the export streams; the connection goes back to the pool when the
+    generator finishes or the client disconnects.
+    """
+    with current_site().pool.read() as conn:
+        conn.execute('BEGIN')
+        total = conn.execute('SELECT COALESCE(SUM(total), 0) as total FROM status_counts').fetchone()['total']
+        yield from render(total, iter_export_rows(conn, app.config['EXPORT_CHUNK_SIZE']))
+
+def merge_site_rows(readers, chunk_size):
+    """Merge the sites' chunked, computer_id-ordered rows into one ordered stream of chunks"""
+    rows = heapq.merge(*(itertools.chain.from_iterable(reader) for reader in readers),
+                       key=lambda row: row['computer_id'])
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+def stream_site_export(render):
+    """Run ``render(total, chunks, with_site=True)`` over every site's rows
+
+    Each site is read from its own snapshot, with its next chunk fetched on
+    the site thread pool while the current ones are merged and rendered, so
+    the sites are read in parallel rather than one after another.
+    """
+    chunk_size = app.config['EXPORT_CHUNK_SIZE']
+    with contextlib.ExitStack() as stack:
+        total = 0
+        readers = []
+        for site in sites:
+            conn = stack.enter_context(site.pool.read())
+            conn.execute('BEGIN')
+            total += conn.execute('SELECT COALESCE(SUM(total), 0) as total FROM status_counts').fetchone()['total']
+            reader = ReadAhead(sites.executor, export_cursor(conn, site.name), chunk_size)
+            # Unwinds before the connection is released
+            stack.callback(reader.close)
+            readers.append(reader)
+        yield from render(total, merge_site_rows(readers, chunk_size), with_site=True)
+
+def streaming_download(text_chunks, mimetype, extension, name='computers'):
+    """Stream an export as a file download, gzip/deflate-encoded when the client allows"""
+    chunks = (chunk.encode('utf-8') for chunk in text_chunks)
+    # Pull the first chunk now so database errors still turn into a 500
+    # instead of a truncated download
+    chunks = itertools.chain([next(chunks, b'')], chunks)
+    
+    headers = {
+        'Content-Disposition': 
+            f'attachment; filename={name}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}',
+        'Vary': 'Accept-Encoding'
+    }
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding:
+        chunks = compress_stream(chunks, encoding)
+        headers['Content-Encoding'] = encoding
+    
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+def render_csv(total, chunks, with_site=False):
+    """CSV export, one piece per chunk of rows"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow((['Site'] if with_site else []) + ['Computer ID', 'Status', 'Notes', 'Last Updated'])
+    
+    for rows in chunks:
+        for comp in rows:
+            writer.writerow(([comp['site']] if with_site else []) + [
+                comp['computer_id'],
+                comp['status'],
+                comp['notes'] or '',
+                comp['updated_at'] or ''
+            ])
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+    
+    # Header only, for an empty fleet
+    if output.tell():
+        yield output.getvalue()
+
+def export_record(comp, with_site=False):
+    """One computer as it appears in the JSON and NDJSON exports"""
+    return {
+        **({'site': comp['site']} if with_site else {}),
+        'computer_id': comp['computer_id'],
+        'status': comp['status'],
+        'notes': comp['notes'] or '',
+        'updated_at': comp['updated_at'] or ''
+    }
+
+def render_json(total, chunks, with_site=False):
+    """Pretty-printed JSON export, same layout as json.dump(indent=2)"""
+    yield (
+        '{\n'
+        f'  "export_timestamp": {json.dumps(datetime.now().isoformat())},\n'
+        f'  "total_computers": {total},\n'
+        '  "computers": ['
+    )
+    
+    separator = '\n'
+    for rows in chunks:
+        items = [
+            textwrap.indent(json.dumps(export_record(comp, with_site), indent=2), '    ')
+            for comp in rows
+        ]
+        yield separator + ',\n'.join(items)
+        separator = ',\n'
+    
+    yield '\n  ]\n}' if separator != '\n' else ']\n}'
+
+def render_compact_json(total, chunks, with_site=False):
+    """JSON export without indentation or spaces (``?compact=1``)"""
+    yield (
+        f'{{"export_timestamp":{json.dumps(datetime.now().isoformat())},'
+        f'"total_computers":{total},"computers":['
+    )
+    
+    separator = ''
+    for rows in chunks:
+        yield separator + ','.join(
+            json.dumps(export_record(comp, with_site), separators=(',', ':')) for comp in rows
+        )
+        separator = ','
+    
+    yield ']}'
+
+def render_ndjson(total, chunks, with_site=False):
+    """Newline-delimited JSON export, one computer per line"""
+    for rows in chunks:
+        yield ''.join(json.dumps(export_record(comp, with_site)) + '\n' for comp in rows)
+
+@site_route('/export/csv')
 def export_csv():
     """Export current data as CSV"""
     try:
-        with DATABASE_LOCK:
-            conn = get_db()
-            try:
-                computers = conn.execute('''
-                    SELECT computer_id, status, notes, updated_at 
-                    FROM computers 
-                    ORDER BY computer_id
-                ''').fetchall()
-                
-                output = io.StringIO()
-                writer = csv.writer(output)
-                writer.writerow(['Computer ID', 'Status', 'Notes', 'Last Updated'])
-                
-                for comp in computers:
-                    writer.writerow([
-                        comp['computer_id'],
-                        comp['status'],
-                        comp['notes'] or '',
-                        comp['updated_at'] or ''
-                    ])
-                
-                output.seek(0)
-                
-                return send_file(
-                    io.BytesIO(output.getvalue().encode('utf-8')),
-                    mimetype='text/csv',
-                    as_attachment=True,
-                    download_name=f'computers_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-                )
-                
-            except Exception as e:
-                print(f"❌ CSV export error: {e}")
-                return f"Export error: {e}", 500
-            finally:
-                conn.close()
+        return streaming_download(stream_export(render_csv), 'text/csv', 'csv')
                 
     except Exception as e:
-        print(f"❌ CSV export API error: {e}")
+        log.error('export_failed format=csv error=%r', e)
         return f"Export error: {e}", 500
 
-@app.route('/export/json')
+@site_route('/export/json')
 def export_json():
-    """Export current data as JSON"""
+    """Export current data as JSON; ``compact=1`` drops the indentation"""
     try:
-        with DATABASE_LOCK:
-            conn = get_db()
-            try:
-                computers = conn.execute('''
-                    SELECT computer_id, status, notes, updated_at 
-                    FROM computers 
-                    ORDER BY computer_id
-                ''').fetchall()
-                
-                computers_list = []
-                for comp in computers:
-                    computers_list.append({
-                        'computer_id': comp['computer_id'],
-                        'status': comp['status'],
-                        'notes': comp['notes'] or '',
-                        'updated_at': comp['updated_at'] or ''
-                    })
-                
-                json_data = {
-                    'export_timestamp': datetime.now().isoformat(),
-                    'total_computers': len(computers_list),
-                    'computers': computers_list
-                }
-                
-                output = io.StringIO()
-                json.dump(json_data, output, indent=2)
-                output.seek(0)
+        render = render_compact_json if request.args.get('compact', type=int) == 1 else render_json
+        return streaming_download(stream_export(render), 'application/json', 'json')
                 
-                return send_file(
-                    io.BytesIO(output.getvalue().encode('utf-8')),
-                    mimetype='application/json',
-                    as_attachment=True,
-                    download_name=f'computers_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-                )
+    except Exception as e:
+        log.error('export_failed format=json error=%r', e)
+        return f"Export error: {e}", 500
+
+@site_route('/export/ndjson')
+def export_ndjson():
+    """Export current data as newline-delimited JSON, for pipelines"""
+    try:
+        return streaming_download(stream_export(render_ndjson), 'application/x-ndjson', 'ndjson')
                 
-            except Exception as e:
-                print(f"❌ JSON export error: {e}")
-                return f"Export error: {e}", 500
-            finally:
-                conn.close()
+    except Exception as e:
+        log.error('export_failed format=ndjson error=%r', e)
+        return f"Export error: {e}", 500
+
+# Cross-site exports: every site's computers merged by computer_id, with a site column
+SITE_EXPORTS = {
+    'csv': (render_csv, 'text/csv'),
+    'json': (render_json, 'application/json'),
+    'ndjson': (render_ndjson, 'application/x-ndjson'),
+}
+
+@app.route('/export/sites/<export_format>')
+def export_sites(export_format):
+    """Export every site at once as csv, json (``compact=1`` allowed) or ndjson"""
+    if export_format not in SITE_EXPORTS:
+        return f"Unknown export format: {export_format}", 404
+    try:
+        render, mimetype = SITE_EXPORTS[export_format]
+        if export_format == 'json' and request.args.get('compact', type=int) == 1:
+            render = render_compact_json
+        return streaming_download(stream_site_export(render), mimetype, export_format, name='computers_all_sites')
                 
     except Exception as e:
-        print(f"❌ JSON export API error: {e}")
+        log.error('export_failed format=%s sites=all error=%r', export_format, e)
         return f"Export error: {e}", 500
 
+fleet_cli = AppGroup('fleet', help='Fleet database maintenance commands.')
+
+def site_option(command):
+    """--site for commands that work on one site's database"""
+    def resolve(ctx, param, name):
+        site = sites.get(name or app.config['DEFAULT_SITE'])
+        if site is None:
+            raise click.BadParameter(f"unknown site (known: {', '.join(sites.names())})")
+        return site
+    return click.option('--site', callback=resolve, help='Site to work on (default: the default site).')(command)
+
+@fleet_cli.command('sites')
+def sites_command():
+    """List every site with its database and computer counts"""
+    for name, (_, stats) in sites.map(read_site_stats).items():
+        counts = ', '.join(f'{status} {total}' for status, total in stats['statuses'].items())
+        click.echo(f"{name}: {stats['total']} computers ({counts}) - {sites.get(name).path}")
+
+@fleet_cli.command('check-stats')
+@click.option('--repair', is_flag=True, help='Rebuild the materialized counts if they are off.')
+@site_option
+def check_stats_command(repair, site):
+    """Compare materialized status counts against the computers table"""
+    # One read snapshot is enough for a consistent check; the write lock is
+    # only taken to repair
+    with site.pool.read() as conn:
+        conn.execute('BEGIN')
+        mismatches = check_stats(conn)
+    if mismatches and repair:
+        with site.pool.write() as conn:
+            rebuild_stats(conn)
+    
+    if not mismatches:
+        click.echo('✅ Status counts are consistent')
+        return
+    for status, (stored, actual) in sorted(mismatches.items(), key=lambda item: str(item[0])):
+        click.echo(f'❌ {status}: stored {stored}, actual {actual}')
+    if repair:
+        click.echo('✅ Status counts rebuilt')
+    else:
+        raise SystemExit(1)
+
+@fleet_cli.command('compact-history')
+@site_option
+def compact_history_command(site):
+    """Delete status events older than HISTORY_RETENTION_DAYS"""
+    deleted = site.history.compact()
+    click.echo(f'✅ Removed {deleted} status events')
+
+def read_import_rows(csv_file):
+    """Columns present and (computer_id, status, notes) rows from an import CSV
+
+    A header row is recognised by a computer_id (or 'Computer ID') first
+    column, which also lets a file from /export/csv be imported as-is.
+    Without a header the first column is the computer ID.
+    """
+    reader = csv.reader(csv_file)
+    first = next(reader, None)
+    if first is None:
+        return [], iter(())
+    
+    header = [column.strip().lower().replace(' ', '_') for column in first]
+    has_header = bool(header) and header[0] == 'computer_id'
+    if has_header:
+        columns = [column for column in ('status', 'notes') if column in header]
+        positions = {column: header.index(column) for column in columns}
+        data_rows = reader
+    else:
+        columns = []
+        positions = {}
+        data_rows = itertools.chain([first], reader)
+    
+    statuses = app.config['STATUSES']
+    
+    def rows():
+        for line_number, row in enumerate(data_rows, start=2 if has_header else 1):
+            if not row or not row[0].strip():
+                continue
+            
+            def value(column, default):
+                position = positions.get(column)
+                return row[position] if position is not None and position < len(row) else default
+            
+            status = value('status', 'pending').strip() or 'pending'
+            if status not in statuses:
+                raise click.ClickException(f"Line {line_number}: invalid status '{status}'")
+            yield row[0].strip(), status, value('notes', '')
+    
+    return columns, rows()
+
+@fleet_cli.command('import')
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--update', is_flag=True,
+              help='Overwrite status/notes of computers that already exist (default: leave them alone).')
+@site_option
+def import_command(csv_file, update, site):
+    """Bulk-load computers from CSV_FILE in a single transaction"""
+    columns, rows = read_import_rows(csv_file)
+    
+    if update and columns:
+        assignments = ', '.join(f'{column} = excluded.{column}' for column in columns)
+        conflict = f'DO UPDATE SET {assignments}'
+    else:
+        conflict = 'DO NOTHING'
+    
+    with site.pool.write() as conn:
+        before = conn.execute('SELECT COALESCE(SUM(total), 0) FROM status_counts').fetchone()[0]
+        result = conn.executemany(f'''
+            INSERT INTO computers (computer_id, status, notes) 
+            VALUES (?, ?, ?) 
+            ON CONFLICT (computer_id) {conflict}
+        ''', rows)
+        after = conn.execute('SELECT COALESCE(SUM(total), 0) FROM status_counts').fetchone()[0]
+    
+    added = after - before
+    click.echo(f'✅ Imported {added} new computers')
+    if update and columns:
+        click.echo(f'✅ Updated {result.rowcount - added} existing computers')
+
+@fleet_cli.command('backup')
+@click.option('--site', 'site_names', multiple=True,
+              help='Site to back up; repeat for several (default: every site).')
+def backup_command(site_names):
+    """Take an online snapshot now, without blocking writers"""
+    targets = []
+    for name in site_names or sites.names():
+        site = sites.get(name)
+        if site is None:
+            raise click.BadParameter(f"unknown site {name} (known: {', '.join(sites.names())})", param_hint='--site')
+        targets.append(site)
+    for site in targets:
+        click.echo(f'✅ {site.name}: {backups.backup(site)}')
+
+@fleet_cli.command('backups')
+@site_option
+def backups_command(site):
+    """List a site's snapshots, oldest first"""
+    snapshots = backups.snapshots(site)
+    for path in snapshots:
+        taken = datetime.fromtimestamp(os.path.getmtime(path)).isoformat(sep=' ', timespec='seconds')
+        click.echo(f'{path}  {os.path.getsize(path)} bytes  {taken}')
+    if not snapshots:
+        click.echo(f'No snapshots in {backups.site_directory(site)}')
+
+@fleet_cli.command('restore')
+@click.argument('snapshot', type=click.Path(exists=True, dir_okay=False))
+@site_option
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+@click.option('--no-backup', is_flag=True, help='Skip the snapshot of the current data taken first.')
+def restore_command(snapshot, site, yes, no_backup):
+    """Replace a site's data with SNAPSHOT, while the app keeps running"""
+    if not yes:
+        click.confirm(f'Replace all data of site {site.name} with {snapshot}?', abort=True)
+    if not no_backup:
+        click.echo(f'✅ Current data saved to {backups.backup(site, label="pre-restore")}')
+    
+    def stamp(conn, live):
+        # Read as late as possible, so writes made while the snapshot was
+        # being checked and migrated are counted: the data version moves
+        # past anything a client may have cached, and every row is marked
+        # changed so delta clients (?since=) fetch it again
+        conn.execute('''
+            UPDATE data_version 
+            SET version = MAX(version, ?) + 1, last_update = CURRENT_TIMESTAMP
+        ''', (fetch_version(live),))
+        conn.execute('UPDATE computers SET change_version = (SELECT version FROM data_version)')
+    
+    restore_database(site.pool, snapshot, prepare=migrate, stamp=stamp)
+    with site.pool.read() as conn:
+        stats = fetch_stats(conn)
+    log.info('database_restored site=%s snapshot=%s', site.name, snapshot)
+    click.echo(f"✅ Restored {site.name} from {snapshot}: {stats['total']} computers")
+
+@fleet_cli.command('checkpoint')
+@site_option
+@click.option('--truncate', is_flag=True,
+              help='Wait for readers and shrink the -wal file to zero (briefly holds writers back).')
+def checkpoint_command(site, truncate):
+    """Copy a site's WAL back into its database file"""
+    mode = 'TRUNCATE' if truncate else 'PASSIVE'
+    busy, wal_pages, moved = checkpoint(site.pool, mode)
+    if busy:
+        click.echo(f'❌ Checkpoint blocked by readers: {moved} of {wal_pages} WAL pages copied')
+        raise SystemExit(1)
+    click.echo(f'✅ Checkpointed {moved} of {wal_pages} WAL pages ({wal_size(site.path)} bytes of WAL left)')
+
+app.cli.add_command(fleet_cli)
+
 if __name__ == '__main__':
     print("🚀 Starting Computer Status Management System...")
     print(f"📊 Database path: {DATABASE}")
+    print(f"🏢 Sites: {', '.join(sites.names())}")
     print("🌐 Starting web server...")
     print("📍 Access your app at: http://localhost:5000")
     print("🔄 All changes are automatically saved to database!")
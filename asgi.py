@@ -0,0 +1,333 @@
+# asgi.py - ASGI entry point: async stats, computers and change stream over the sync app
+#
+# Serve with any ASGI server, e.g. ``uvicorn asgi:application``. /api/stats,
+# /api/computers and /api/events (also under /site/<site>/) and /api/sites are
+# handled here; every other request is passed to the Flask app (through
+# asgiref when it is installed).
+import asyncio
+import io
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_accept_header, parse_etags
+
+from app import (
+    app, backups, catch_up, compress_response, load_computers, load_site_stats, load_stats, log,
+    request_count, request_latency, response_size, sites, stream_message, stream_position
+)
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+# Bounded so a burst of dashboards queues for SQLite instead of piling up threads
+db_executor = ThreadPoolExecutor(max_workers=app.config['ASYNC_DB_WORKERS'], thread_name_prefix='asgi-db')
+wsgi_executor = ThreadPoolExecutor(max_workers=app.config['ASYNC_WSGI_WORKERS'], thread_name_prefix='asgi-wsgi')
+
+
+class Broadcast:
+    """Wakes every coroutine parked on the change feed when something is published.
+
+    All waiters share one future that is resolved and replaced on each
+    publish, so an idle stream costs a suspended coroutine, not a thread.
+    """
+
+    def __init__(self, feed):
+        self.feed = feed
+        self._loop = None
+        self._future = None
+
+    def attach(self, loop):
+        """Bind to the serving event loop; publishes from any thread are forwarded to it"""
+        if self._loop is None:
+            self._loop = loop
+            self._future = loop.create_future()
+            self.feed.add_listener(self._published)
+
+    def _published(self):
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            # The loop has shut down; nobody is waiting any more
+            pass
+
+    def _wake(self):
+        future, self._future = self._future, self._loop.create_future()
+        future.set_result(None)
+
+    async def wait(self, after, notices_after, timeout, disconnected):
+        """Like ChangeFeed.wait, but also returns early once ``disconnected`` is done"""
+        if self.feed.seq <= after and self.feed.notice_seq == notices_after:
+            await asyncio.wait({self._future, disconnected}, timeout=timeout,
+                               return_when=asyncio.FIRST_COMPLETED)
+        return self.feed.since(after, notices_after)
+
+
+# One per site, since each site has its own change feed
+broadcasts = {site.name: Broadcast(site.feed) for site in sites}
+
+
+def request_args(scope):
+    return MultiDict(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True))
+
+
+def request_headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+
+async def send_response(scope, send, response):
+    """Send a complete (non-streamed) Flask response, compressed like the sync app's"""
+    response = compress_response(response, parse_accept_header(request_headers(scope).get('accept-encoding')))
+    body = response.get_data()
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+    return len(body)
+
+
+def json_response(etag, payload):
+    """Same bytes and headers the sync routes produce with jsonify/not_modified"""
+    if payload is None:
+        response = app.response_class(status=304)
+    else:
+        response = app.json.response(payload)
+    if etag:
+        response.set_etag(etag)
+    return response
+
+
+async def run_loader(loader, *args):
+    """Run a database loader on the executor, turning failures into the usual JSON error"""
+    loop = asyncio.get_running_loop()
+    try:
+        return json_response(*await loop.run_in_executor(db_executor, loader, *args))
+    except Exception as e:
+        log.error('async_request_failed loader=%s error=%r', loader.__name__, e)
+        return app.json.response({'success': False, 'error': str(e)})
+
+
+async def get_stats(scope, receive, send, site):
+    etags = parse_etags(request_headers(scope).get('if-none-match'))
+    return await send_response(scope, send, await run_loader(load_stats, site, etags))
+
+
+async def get_computers(scope, receive, send, site):
+    etags = parse_etags(request_headers(scope).get('if-none-match'))
+    return await send_response(scope, send, await run_loader(load_computers, site, request_args(scope), etags))
+
+
+async def get_sites(scope, receive, send, site):
+    etags = parse_etags(request_headers(scope).get('if-none-match'))
+    return await send_response(scope, send, await run_loader(load_site_stats, etags))
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def event_stream(scope, receive, send, site):
+    """Server-Sent Events stream; idle clients wait on the broadcast, not a thread"""
+    broadcast = broadcasts[site.name]
+    loop = asyncio.get_running_loop()
+    broadcast.attach(loop)
+    # Starting the site's change watcher reads the database
+    after, notices_after = await loop.run_in_executor(
+        db_executor, stream_position,
+        site, request_headers(scope).get('last-event-id') or request_args(scope).get('last_event_id')
+    )
+    keepalive = app.config['EVENTS_KEEPALIVE']
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        body = b'retry: 3000\n\n'
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        sent = len(body)
+        changes, notices = site.feed.since(after, notices_after)
+        while True:
+            if changes is None:
+                # Not in this process's buffer - too old, or written by
+                # another worker this one has not polled yet
+                changes = await loop.run_in_executor(db_executor, catch_up, site, after)
+            after, notices_after, message = stream_message(site.feed, after, notices_after, changes, notices)
+            body = message.encode('utf-8')
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+            sent += len(body)
+            changes, notices = await broadcast.wait(after, notices_after, keepalive, disconnected)
+            if disconnected.done():
+                return sent
+    finally:
+        disconnected.cancel()
+
+
+# Served for the default site as-is and for any site under /site/<site>
+ASYNC_ROUTES = {
+    '/api/stats': get_stats,
+    '/api/computers': get_computers,
+    '/api/events': event_stream,
+}
+# Not tied to one site
+ASYNC_GLOBAL_ROUTES = {
+    '/api/sites': get_sites,
+}
+
+SITE_PATH = re.compile(r'^/site/([^/]+)(/.*)$')
+
+
+def resolve_route(path):
+    """``(handler, site, route pattern)`` for a path served here, or None
+
+    Unknown sites are left to the Flask app, which answers them with a 404.
+    """
+    if path in ASYNC_GLOBAL_ROUTES:
+        return ASYNC_GLOBAL_ROUTES[path], None, path
+    site_name, route, pattern = app.config['DEFAULT_SITE'], path, path
+    match = SITE_PATH.match(path)
+    if match:
+        site_name, route = match.groups()
+        pattern = f'/site/<site>{route}'
+    handler = ASYNC_ROUTES.get(route)
+    site = sites.get(site_name)
+    if handler is None or site is None:
+        return None
+    return handler, site, pattern
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ for an ASGI HTTP request with an already-read body"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    # The body has been read in full, whatever framing the client used
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+async def wsgi_fallback(scope, receive, send):
+    """Run the sync Flask app on a thread, streaming its body chunk by chunk"""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body.extend(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+
+    loop = asyncio.get_running_loop()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    def call_app():
+        chunks = app.wsgi_app(wsgi_environ(scope, bytes(body)), start_response)
+        iterator = iter(chunks)
+        # Headers are only final once the first chunk has been produced
+        return chunks, iterator, next(iterator, None)
+
+    chunks, iterator, chunk = await loop.run_in_executor(wsgi_executor, call_app)
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': started['status'],
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in started['headers']],
+        })
+        while chunk is not None:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await loop.run_in_executor(wsgi_executor, next, iterator, None)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(chunks, 'close'):
+            await loop.run_in_executor(wsgi_executor, chunks.close)
+
+
+fallback = WsgiToAsgi(app) if WsgiToAsgi is not None else wsgi_fallback
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            for broadcast in broadcasts.values():
+                broadcast.attach(asyncio.get_running_loop())
+            backups.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            db_executor.shutdown(wait=False)
+            wsgi_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI application"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    route = resolve_route(scope['path']) if scope['method'] == 'GET' else None
+    if route is None:
+        # The Flask app records its own request metrics
+        return await fallback(scope, receive, send)
+    handler, site, endpoint = route
+
+    started = time.perf_counter()
+    status = 200
+    original_send = send
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            # Streams count as done once their headers are out, as in the sync app
+            request_latency.observe(time.perf_counter() - started, endpoint=endpoint, method='GET')
+            request_count.inc(endpoint=endpoint, method='GET', status=status)
+        await original_send(message)
+
+    sent = await handler(scope, receive, send, site)
+    response_size.observe(sent or 0, endpoint=endpoint)
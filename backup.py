@@ -0,0 +1,327 @@
+# backup.py - Online snapshots through the SQLite backup API, rotation and WAL checkpoints
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no cross-process lock, so run a single serving process there
+    fcntl = None
+
+log = logging.getLogger('computer_status.backup')
+
+SNAPSHOT_EXTENSION = '.db'
+PARTIAL_EXTENSION = '.partial'
+SCHEDULER_LOCK = '.scheduler.lock'
+
+
+def snapshot_name(site_name, label=None, moment=None):
+    """File name of a snapshot; names sort in the order the snapshots were taken"""
+    moment = moment or datetime.now(timezone.utc)
+    suffix = f'-{label}' if label else ''
+    return f"{site_name}-{moment.strftime('%Y%m%dT%H%M%S%fZ')}{suffix}{SNAPSHOT_EXTENSION}"
+
+
+def list_snapshots(directory):
+    """Finished snapshot paths in ``directory``, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    return [
+        os.path.join(directory, name) for name in sorted(os.listdir(directory))
+        if name.endswith(SNAPSHOT_EXTENSION)
+    ]
+
+
+def wal_size(path):
+    """Bytes in a database's -wal file (0 when there is none)"""
+    try:
+        return os.path.getsize(f'{path}-wal')
+    except OSError:
+        return 0
+
+
+def backup_database(pool, path, pages=1024, sleep=0.01):
+    """Copy a live database to ``path`` with the SQLite backup API; returns its page count
+
+    The copy is read from a single WAL snapshot held open for the whole
+    backup. Writers carry on meanwhile and, since the snapshot cannot
+    change, never make the backup start over - without it every commit
+    elsewhere restarts the copy, so under sustained writes it may never
+    finish. ``pages`` pages are copied per step, ``sleep`` seconds apart, so
+    the copy's disk reads are spread out instead of competing with requests
+    in one burst.
+
+    The copy is written next to ``path``, checked and then moved into place,
+    so ``path`` only ever holds a complete snapshot.
+    """
+    partial = f'{path}.{os.getpid()}{PARTIAL_EXTENSION}'
+    target = sqlite3.connect(partial)
+
+    def pace(status, remaining, total):
+        # Connection.backup only sleeps when a step hits BUSY or LOCKED, never
+        # between steps that succeed, so the pause between steps happens here
+        if remaining and sleep:
+            time.sleep(sleep)
+
+    try:
+        with pool.read() as conn:
+            conn.execute('BEGIN')
+            # The first read pins the snapshot
+            conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            conn.backup(target, pages=pages, progress=pace)
+
+        check = target.execute('PRAGMA quick_check').fetchone()[0]
+        if check != 'ok':
+            raise sqlite3.DatabaseError(f'Snapshot failed quick_check: {check}')
+        # A self-contained single file, whatever the live database uses
+        target.execute('PRAGMA journal_mode=DELETE')
+        page_count = target.execute('PRAGMA page_count').fetchone()[0]
+        target.close()
+        os.replace(partial, path)
+        return page_count
+    except BaseException:
+        target.close()
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def restore_database(pool, snapshot, prepare=None, stamp=None):
+    """Replace a live database's contents with ``snapshot``
+
+    The snapshot is copied to a staging file and checked there, and
+    ``prepare(conn)`` may then bring it up to date (migrations) before anyone
+    can see it. ``stamp(staging, live)`` runs last, right before the copy,
+    to carry state over from the live database (such as its data version)
+    while the app may still be writing to it. The result is written into the live
+    database with the backup API in a single step, so other connections -
+    in this process or any other - see either the old data or the restored
+    data, never a mix. Copying a file over a live WAL database would not
+    be safe.
+    """
+    fd, staging_path = tempfile.mkstemp(
+        suffix='.restore', dir=os.path.dirname(os.path.abspath(pool.path))
+    )
+    os.close(fd)
+    try:
+        source = sqlite3.connect(f'file:{os.path.abspath(snapshot)}?mode=ro', uri=True)
+        staging = sqlite3.connect(staging_path)
+        staging.row_factory = sqlite3.Row
+        try:
+            source.backup(staging)
+            check = staging.execute('PRAGMA quick_check').fetchone()[0]
+            if check != 'ok':
+                raise sqlite3.DatabaseError(f'{snapshot} failed quick_check: {check}')
+            if prepare is not None:
+                prepare(staging)
+                staging.commit()
+
+            with pool.read() as conn:
+                if stamp is not None:
+                    stamp(staging, conn)
+                    staging.commit()
+                    # The copy needs the live connection without a transaction
+                    conn.rollback()
+                # One step: the live database's write lock is held for the
+                # whole copy instead of being released part-way through
+                staging.backup(conn, pages=-1)
+        finally:
+            source.close()
+            staging.close()
+    finally:
+        os.remove(staging_path)
+
+
+def checkpoint(pool, mode='PASSIVE', busy_timeout=None):
+    """Run a WAL checkpoint; returns ``(busy, wal_pages, checkpointed_pages)``
+
+    PASSIVE never waits. RESTART and TRUNCATE hold off new writers while
+    they wait for readers, so give them a short ``busy_timeout`` (seconds)
+    to bound how long writers can be stalled.
+    """
+    with pool.read() as conn:
+        if busy_timeout is not None:
+            conn.execute(f'PRAGMA busy_timeout = {int(busy_timeout * 1000)}')
+        try:
+            return tuple(conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone())
+        finally:
+            if busy_timeout is not None:
+                conn.execute(f"PRAGMA busy_timeout = {pool.pragmas['busy_timeout']}")
+
+
+class BackupScheduler:
+    """Takes scheduled snapshots of every site and keeps their WAL files in check.
+
+    A background thread wakes every ``checkpoint_interval`` seconds. For each
+    site it runs a PASSIVE checkpoint, escalating to TRUNCATE (bounded by
+    ``truncate_busy_timeout``) once the WAL has grown past ``wal_max_bytes``,
+    and takes a snapshot when the newest one on disk is older than
+    ``backup_interval``, keeping the newest ``keep``. Going by the snapshots
+    on disk instead of a timer means a restarted process does not take one
+    straight away. Only the process holding ``directory/.scheduler.lock``
+    runs the rounds, so worker processes sharing the directory do not each
+    check and take the same backup; the others keep trying for the lock
+    and take over when its holder exits.
+
+    Snapshots go to ``directory/<site>/``. An optional ``observer`` (see
+    metrics.BackupMetrics) is told about each backup and checkpoint.
+    """
+
+    def __init__(self, sites, directory, backup_interval=None, keep=28, pages=1024, sleep=0.01,
+                 checkpoint_interval=60, wal_max_bytes=64 * 1024 * 1024, truncate_busy_timeout=0.1,
+                 observer=None):
+        self.sites = sites
+        self.directory = directory
+        self.backup_interval = backup_interval
+        self.keep = keep
+        self.pages = pages
+        self.sleep = sleep
+        self.checkpoint_interval = checkpoint_interval
+        self.wal_max_bytes = wal_max_bytes
+        self.truncate_busy_timeout = truncate_busy_timeout
+        self.observer = observer
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._lock_file = None
+
+    def site_directory(self, site):
+        return os.path.join(self.directory, site.name)
+
+    def snapshots(self, site):
+        """A site's snapshots, oldest first"""
+        return list_snapshots(self.site_directory(site))
+
+    def backup(self, site, label=None):
+        """Snapshot one site now and apply the retention policy; returns the snapshot path"""
+        directory = self.site_directory(site)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, snapshot_name(site.name, label))
+
+        started = time.perf_counter()
+        try:
+            page_count = backup_database(site.pool, path, pages=self.pages, sleep=self.sleep)
+        except Exception:
+            if self.observer is not None:
+                self.observer.backup_failed(site.name)
+            raise
+        elapsed = time.perf_counter() - started
+        if self.observer is not None:
+            self.observer.backed_up(site.name, elapsed, page_count)
+        log.info('backup_finished site=%s path=%s pages=%d seconds=%.3f', site.name, path, page_count, elapsed)
+
+        # The backup's long read may have held checkpoints back
+        self.checkpoint(site)
+        self.rotate(site)
+        return path
+
+    def rotate(self, site):
+        """Delete all but the newest ``keep`` snapshots, and abandoned partial ones; returns how many"""
+        removed = 0
+        snapshots = self.snapshots(site)
+        expired = snapshots[:-self.keep] if self.keep else []
+        for path in expired + self._partials(site, older_than=self.backup_interval or 86400):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError as e:
+                log.warning('backup_remove_failed path=%s error=%r', path, e)
+        return removed
+
+    def checkpoint(self, site):
+        """Apply the checkpoint policy to one site; returns the wal_checkpoint result"""
+        mode = 'TRUNCATE' if wal_size(site.path) > self.wal_max_bytes else 'PASSIVE'
+        busy_timeout = self.truncate_busy_timeout if mode == 'TRUNCATE' else None
+        busy, wal_pages, moved = checkpoint(site.pool, mode, busy_timeout)
+        if self.observer is not None:
+            self.observer.checkpointed(site.name, mode, busy, moved)
+        if mode == 'TRUNCATE':
+            log.info('wal_truncated site=%s busy=%d wal_pages=%d checkpointed=%d', site.name, busy, wal_pages, moved)
+        return busy, wal_pages, moved
+
+    def backup_due(self, site):
+        """Whether a site's newest snapshot (or one in progress) is older than backup_interval"""
+        if not self.backup_interval:
+            return False
+        if self._partials(site, newer_than=self.backup_interval):
+            return False
+        snapshots = self.snapshots(site)
+        return not snapshots or time.time() - os.path.getmtime(snapshots[-1]) >= self.backup_interval
+
+    def run_once(self):
+        """One round of checkpoints and due backups across every site"""
+        for site in self.sites:
+            if self._stopping.is_set():
+                return
+            try:
+                self.checkpoint(site)
+                if self.backup_due(site):
+                    self.backup(site)
+            except Exception as e:
+                log.error('backup_round_failed site=%s error=%r', site.name, e)
+
+    def start(self):
+        """Start the background thread"""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='backup-scheduler', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, letting a backup in progress finish"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def holds_lock(self):
+        """Whether this process runs the rounds, taking the lock file if it is free"""
+        if self._lock_file is not None or fcntl is None:
+            return True
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, SCHEDULER_LOCK), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _partials(self, site, newer_than=None, older_than=None):
+        directory = self.site_directory(site)
+        if not os.path.isdir(directory):
+            return []
+        now = time.time()
+        partials = []
+        for name in os.listdir(directory):
+            if not name.endswith(PARTIAL_EXTENSION):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                age = now - os.path.getmtime(path)
+            except OSError:
+                continue
+            if (newer_than is None or age < newer_than) and (older_than is None or age >= older_than):
+                partials.append(path)
+        return partials
+
+    def _run(self):
+        while not self._stopping.wait(self.checkpoint_interval):
+            try:
+                if not self.holds_lock():
+                    continue
+            except OSError as e:
+                log.error('backup_lock_failed directory=%s error=%r', self.directory, e)
+                continue
+            self.run_once()
@@ -0,0 +1,4 @@
+# benchmarks - Load and latency benchmarks for the HTTP API
+#
+# Run with:  python -m benchmarks --computers 10000 --readers 8 --writers 2
+# See ``python -m benchmarks --help`` for every option.
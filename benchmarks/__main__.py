@@ -0,0 +1,5 @@
+# benchmarks/__main__.py - Command-line entry point: python -m benchmarks
+from benchmarks.runner import main
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+# benchmarks/runner.py - Seed a synthetic fleet and drive the real routes under load
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# Relative weights of the requests each kind of worker makes
+READ_MIX = [
+    ('GET /api/stats', 40),
+    ('GET /api/computers?limit=200', 25),
+    ('GET /api/computers', 5),
+    ('GET /', 25),
+    ('GET /export/csv', 5),
+]
+WRITE_MIX = [
+    ('POST /api/toggle_status', 60),
+    ('POST /api/update_notes', 38),
+    ('POST /api/bulk_update', 2),
+]
+HEARTBEAT_MIX = [
+    ('POST /api/heartbeat', 1),
+]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    """Per-endpoint throughput and latency (milliseconds) from raw samples"""
+    endpoints = {}
+    for name in sorted(set(latencies) | set(errors)):
+        samples = sorted(latencies.get(name, []))
+        endpoints[name] = {
+            'requests': len(samples),
+            'errors': errors.get(name, 0),
+            'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+            'mean_ms': round(sum(samples) / len(samples), 3) if samples else None,
+            'p50_ms': percentile(samples, 0.50),
+            'p95_ms': percentile(samples, 0.95),
+            'p99_ms': percentile(samples, 0.99),
+            'max_ms': samples[-1] if samples else None,
+        }
+    total = sum(endpoint['requests'] for endpoint in endpoints.values())
+    return {
+        'total_requests': total,
+        'total_errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+        'throughput_rps': round(total / elapsed, 2) if elapsed else None,
+        'endpoints': endpoints,
+    }
+
+
+def succeeded(status, mimetype, data):
+    """Whether a response counts as a success
+
+    The API reports most failures as HTTP 200 with ``success: false``.
+    """
+    if status >= 400:
+        return False
+    if mimetype == 'application/json' and data.startswith(b'{'):
+        try:
+            return json.loads(data).get('success', True) is not False
+        except ValueError:
+            return False
+    return True
+
+
+def git_commit():
+    """Current commit of the working tree, so results can be compared across commits"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def seed_fleet(app_module, size):
+    """Replace the default site's computers with ``size`` synthetic ones in one transaction"""
+    computer_ids = [f'BENCH{index:06d}' for index in range(size)]
+    with app_module.default_site().pool.write() as conn:
+        conn.execute('DELETE FROM computers')
+        conn.executemany('''
+            INSERT INTO computers (computer_id, status, notes)
+            VALUES (?, ?, '')
+        ''', ((computer_id, random.choice(('pending', 'ready'))) for computer_id in computer_ids))
+    return computer_ids
+
+
+class TestClientTransport:
+    """Sends requests in-process through Flask's test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        # Drain streamed bodies (exports) so their cost is measured
+        return response.status_code, response.mimetype, response.get_data()
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    """Sends requests over a real socket to the local threaded server"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.connection = http.client.HTTPConnection(host, port, timeout=60)
+
+    def request(self, method, path, body=None):
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            # The development server closes connections; reconnect and retry once
+            self.connection.close()
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.connection.request(method, path, body=payload, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        if response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+            self.connection.close()
+        mimetype = (response.getheader('Content-Type') or '').split(';')[0]
+        return response.status, mimetype, data
+
+    def close(self):
+        self.connection.close()
+
+
+class Benchmark:
+    """Runs reader and writer threads against one app for a fixed duration"""
+
+    def __init__(self, make_transport, computer_ids, readers, writers, duration, seed, agents=0):
+        self.make_transport = make_transport
+        self.computer_ids = computer_ids
+        self.readers = readers
+        self.writers = writers
+        self.agents = agents
+        self.duration = duration
+        self.seed = seed
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def _record(self, name, elapsed_ms, ok):
+        with self._lock:
+            if ok:
+                self.latencies.setdefault(name, []).append(round(elapsed_ms, 3))
+            else:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def _request_for(self, name, rng):
+        method, path = name.split(' ', 1)
+        if name == 'POST /api/toggle_status':
+            return method, path, {'computer_id': rng.choice(self.computer_ids)}
+        if name == 'POST /api/update_notes':
+            return method, path, {
+                'computer_id': rng.choice(self.computer_ids),
+                'notes': f'bench note {rng.randrange(1_000_000)}'
+            }
+        if name == 'POST /api/bulk_update':
+            return method, path, {'status': rng.choice(('pending', 'ready'))}
+        if name == 'POST /api/heartbeat':
+            return method, path, {'computer_id': rng.choice(self.computer_ids), 'state': 'online'}
+        return method, path, None
+
+    def _worker(self, mix, worker_seed, deadline):
+        rng = random.Random(worker_seed)
+        names = [name for name, _ in mix]
+        weights = [weight for _, weight in mix]
+        transport = self.make_transport()
+        try:
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                method, path, body = self._request_for(name, rng)
+                started = time.perf_counter()
+                try:
+                    ok = succeeded(*transport.request(method, path, body))
+                except Exception:
+                    ok = False
+                self._record(name, (time.perf_counter() - started) * 1000, ok)
+        finally:
+            transport.close()
+
+    def run(self):
+        deadline = time.perf_counter() + self.duration
+        threads = []
+        for index in range(self.readers):
+            threads.append(threading.Thread(
+                target=self._worker, args=(READ_MIX, self.seed + index, deadline), daemon=True
+            ))
+        for index in range(self.writers):
+            threads.append(threading.Thread(
+                target=self._worker, args=(WRITE_MIX, self.seed + 1000 + index, deadline), daemon=True
+            ))
+        for index in range(self.agents):
+            threads.append(threading.Thread(
+                target=self._worker, args=(HEARTBEAT_MIX, self.seed + 2000 + index, deadline), daemon=True
+            ))
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(self.latencies, self.errors, time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def local_server(app):
+    """Serve ``app`` on an ephemeral localhost port with the threaded dev server"""
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.host, server.port
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def compare(current, baseline):
+    """p50/p95/p99 change per endpoint versus an earlier result, in percent"""
+    changes = {}
+    for name, endpoint in current['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        changes[name] = {}
+        for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if endpoint.get(key) is not None and before.get(key):
+                changes[name][key] = round((endpoint[key] - before[key]) / before[key] * 100, 1)
+    return changes
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description='Load and latency benchmark for the computer status API.'
+    )
+    parser.add_argument('--computers', type=int, default=1000,
+                        help='Synthetic fleet size to seed (default: 1000)')
+    parser.add_argument('--readers', type=int, default=8,
+                        help='Concurrent reader threads (default: 8)')
+    parser.add_argument('--writers', type=int, default=2,
+                        help='Concurrent writer threads (default: 2)')
+    parser.add_argument('--agents', type=int, default=0,
+                        help='Concurrent threads posting agent heartbeats (default: 0)')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='Seconds to run the load for (default: 10)')
+    parser.add_argument('--server', action='store_true',
+                        help='Go through a local threaded HTTP server instead of the test client')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Random seed for the request mix (default: 1)')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='Earlier JSON report to compute latency changes against')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    started_at = datetime.now().isoformat()
+
+    with tempfile.TemporaryDirectory(prefix='computer-status-bench-') as workdir:
+        # The app reads its database path and log level at import time; keep
+        # per-request logging out of the measurements. Only the benchmark's
+        # own site is opened, never the real site databases.
+        os.environ['COMPUTER_STATUS_DB'] = os.path.join(workdir, 'bench.db')
+        os.environ['COMPUTER_STATUS_SITES_DIR'] = os.path.join(workdir, 'sites')
+        os.environ['COMPUTER_STATUS_SITES'] = ''
+        # No scheduled backup in the middle of the measurements
+        os.environ['COMPUTER_STATUS_BACKUP_INTERVAL'] = '0'
+        os.environ.setdefault('COMPUTER_STATUS_LOG_LEVEL', 'WARNING')
+        with contextlib.redirect_stdout(sys.stderr):
+            import app as app_module
+
+        print(f'Seeding {args.computers} computers...', file=sys.stderr)
+        computer_ids = seed_fleet(app_module, args.computers)
+
+        if args.server:
+            with local_server(app_module.app) as (host, port):
+                benchmark = Benchmark(
+                    lambda: HTTPTransport(host, port), computer_ids,
+                    args.readers, args.writers, args.duration, args.seed, args.agents
+                )
+                results = benchmark.run()
+        else:
+            benchmark = Benchmark(
+                lambda: TestClientTransport(app_module.app), computer_ids,
+                args.readers, args.writers, args.duration, args.seed, args.agents
+            )
+            results = benchmark.run()
+        app_module.sites.close()
+
+    report = {
+        'commit': git_commit(),
+        'started_at': started_at,
+        'config': {
+            'computers': args.computers,
+            'readers': args.readers,
+            'writers': args.writers,
+            'agents': args.agents,
+            'duration': args.duration,
+            'transport': 'http' if args.server else 'test_client',
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            report['changes_pct'] = compare(results, json.load(baseline_file)['results'])
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(output + '\n')
+        print(f'Report written to {args.output}', file=sys.stderr)
+    else:
+        print(output)
@@ -0,0 +1,165 @@
+# changefeed.py - Change feed behind the /api/events SSE stream, fed from the database
+import logging
+import threading
+from collections import deque
+
+log = logging.getLogger('computer_status.changefeed')
+
+
+class ChangeFeed:
+    """Recently committed changes, keyed by the database's data version.
+
+    Changes are published by a ChangeWatcher under the data version they
+    were read at, so a stream position means the same thing in every worker
+    process: a client can reconnect anywhere and resume from its
+    Last-Event-ID. ``since`` answers from the buffer when it covers the
+    client's position and returns None when it does not, in which case the
+    caller catches up from the database instead.
+
+    Notices (heartbeat transitions) are not tied to a data version; they go
+    to whoever is connected when they happen, counted by ``notice_seq``.
+
+    Threads block in ``wait``; anything else (the asyncio broadcast in
+    asgi.py) registers a listener that is called after every publish.
+    """
+
+    def __init__(self, maxlen=1000):
+        # (previous version, version, payload)
+        self._events = deque(maxlen=maxlen)
+        self._notices = deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self._listeners = []
+        self.seq = 0
+        self.notice_seq = 0
+
+    def publish(self, seq, payload=None):
+        """Record the changes up to data version ``seq``; without a payload only moves the position"""
+        with self._cond:
+            if seq <= self.seq:
+                return
+            if payload is None:
+                # Nothing buffered covers the versions skipped here
+                self._events.clear()
+            else:
+                self._events.append((self.seq, seq, payload))
+            self.seq = seq
+            self._cond.notify_all()
+        self._notify_listeners()
+
+    def reset(self, seq):
+        """Start over at data version ``seq``, dropping everything buffered"""
+        with self._cond:
+            self._events.clear()
+            self.seq = seq
+            self._cond.notify_all()
+        self._notify_listeners()
+
+    def notify(self, payload):
+        """Send a notice to every connected client. Returns its number."""
+        with self._cond:
+            self.notice_seq += 1
+            notice_seq = self.notice_seq
+            self._notices.append((notice_seq, payload))
+            self._cond.notify_all()
+        self._notify_listeners()
+        return notice_seq
+
+    def add_listener(self, listener):
+        """Call ``listener()`` from the publishing thread after every publish or notice"""
+        self._listeners.append(listener)
+
+    def since(self, after, notices_after):
+        """``(changes, notices)`` newer than the given positions
+
+        changes is None when the buffer does not cover ``after``: it is too
+        old, or ahead of this process (from another worker, or another
+        database).
+        """
+        with self._cond:
+            return self._since(after), self._notices_since(notices_after)
+
+    def wait(self, after, notices_after, timeout=None):
+        """Block until there is something newer than the given positions (or timeout)"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.seq > after or self.notice_seq != notices_after, timeout=timeout
+            )
+            return self._since(after), self._notices_since(notices_after)
+
+    def _notify_listeners(self):
+        for listener in self._listeners:
+            listener()
+
+    def _since(self, after):
+        if after == self.seq:
+            return []
+        if after > self.seq or not self._events or self._events[0][0] > after:
+            return None
+        # An event may also hold rows the client already has; applying a
+        # row twice is harmless
+        return [(seq, payload) for _, seq, payload in self._events if seq > after]
+
+    def _notices_since(self, after):
+        return [notice for notice in self._notices if notice[0] > after]
+
+
+class ChangeWatcher:
+    """Polls a database for commits from any process and publishes them to a ChangeFeed.
+
+    ``load(after)`` returns ``(version, payload)``: the current data version
+    and everything changed since data version ``after`` (payload None when
+    nothing did, or when ``after`` is None). A background thread calls it
+    every ``interval`` seconds; writers in this process call ``poke`` after
+    committing so their own changes go out straight away.
+    """
+
+    def __init__(self, feed, load, interval=0.5):
+        self.feed = feed
+        self.load = load
+        self.interval = interval
+        self._wake = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def poke(self):
+        """Poll now instead of at the next interval"""
+        self._wake.set()
+
+    def poll(self):
+        """Publish whatever was committed since the feed's position"""
+        version, payload = self.load(self.feed.seq)
+        if payload is not None:
+            self.feed.publish(version, payload)
+        elif version < self.feed.seq:
+            # The database was replaced under us; clients ahead of it resync
+            log.warning('data_version_went_back from=%d to=%d', self.feed.seq, version)
+            self.feed.reset(version)
+        else:
+            self.feed.publish(version)
+
+    def start(self):
+        """Start polling; the first poll only records the current version"""
+        with self._start_lock:
+            if self._thread is None:
+                self.feed.publish(self.load(None)[0])
+                self._thread = threading.Thread(target=self._run, name='change-watcher', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                self.poll()
+            except Exception as e:
+                log.error('change_poll_failed error=%r', e)
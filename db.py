@@ -0,0 +1,219 @@
+# db.py - Pooled SQLite connections: concurrent WAL readers, BEGIN IMMEDIATE writers
+import sqlite3
+import queue
+from contextlib import contextmanager
+from time import perf_counter
+
+# Default pragmas applied to every connection the pool opens
+DEFAULT_PRAGMAS = {
+    'synchronous': 'NORMAL',     # Safe with WAL, avoids an fsync per commit
+    'cache_size': -20000,        # Negative = KiB, so ~20 MB page cache
+    'mmap_size': 268435456,      # 256 MB memory-mapped I/O for reads
+    'busy_timeout': 20000,       # Milliseconds to wait on a locked database
+    'temp_store': 'MEMORY',
+    'wal_autocheckpoint': 1000,  # Pages; commits past this try a PASSIVE checkpoint
+    'journal_size_limit': 67108864,  # Shrink the -wal file back to 64 MB once it is reset
+}
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that reports each statement's time and row count to an observer.
+
+    Time covers executing the statement and fetching its rows. A statement
+    is reported once its rows are exhausted, the cursor is reused, or the
+    cursor is garbage collected.
+    """
+
+    _sql = None
+    _rows = 0
+    _elapsed = 0.0
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        return self._timed(sql, super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        return self._timed(sql, super().executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        row = self._fetch(super().fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._fetch(super().fetchmany, size)
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(super().fetchall)
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._fetch(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+        self._rows += 1
+        return row
+
+    def __del__(self):
+        self._finish()
+
+    def _timed(self, sql, method, *args):
+        self._sql = sql
+        self._rows = 0
+        self._elapsed = 0.0
+        started = perf_counter()
+        try:
+            result = method(*args)
+        finally:
+            self._elapsed += perf_counter() - started
+        # Writes and DDL have no rows to fetch
+        if self.description is None:
+            self._finish()
+        return result
+
+    def _fetch(self, method, *args):
+        started = perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._sql is not None:
+                self._elapsed += perf_counter() - started
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        sql, self._sql = self._sql, None
+        observer = self.connection.observer
+        if observer is not None:
+            observer.statement(sql, self._elapsed, self._rows)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose shortcut execute methods go through InstrumentedCursor"""
+
+    observer = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute does not go through cursor(), so route it explicitly
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ConnectionPool:
+    """Hands out configured SQLite connections.
+
+    Connections are borrowed from a pool of up to ``max_idle`` idle ones.
+    Under WAL readers run concurrently with each other and with a writer.
+    Writes take SQLite's own write lock with BEGIN IMMEDIATE instead of a
+    process-wide lock, so writers in every worker process queue on the same
+    lock (bounded by busy_timeout) and never hit a deadlock upgrading a
+    read transaction.
+
+    An optional ``observer`` (see metrics.DatabaseMetrics) is told about
+    every connection opened, every wait for the write lock and every
+    statement executed.
+    """
+
+    def __init__(self, path, pragmas=None, max_idle=16, timeout=20.0, observer=None):
+        self.path = path
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas or {})
+        self.timeout = timeout
+        self.observer = observer
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._closed = False
+
+    def _connect(self):
+        """Open a new connection and apply the configured pragmas once."""
+        if self.observer is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                                   factory=InstrumentedConnection)
+            conn.observer = self.observer
+            self.observer.connection_opened()
+        conn.row_factory = sqlite3.Row
+        # journal_mode is persistent in the file, but setting it is cheap and
+        # makes a brand-new database come up in WAL mode
+        conn.execute('PRAGMA journal_mode=WAL')
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name}={value}')
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, conn):
+        # Never hand a connection back with an open transaction, otherwise
+        # it would pin an old WAL snapshot (or hold the write lock)
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+        else:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def read(self):
+        """Borrow a read connection; returned to the pool afterwards."""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def write(self):
+        """Run a write transaction, holding SQLite's write lock from the start.
+
+        Commits when the block exits normally, rolls back on exception.
+        """
+        conn = self._acquire()
+        try:
+            started = perf_counter()
+            # A plain cursor: the wait is reported as lock wait only, not
+            # also as a (slow) statement
+            sqlite3.Cursor(conn).execute('BEGIN IMMEDIATE')
+            if self.observer is not None:
+                self.observer.lock_waited(perf_counter() - started)
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        finally:
+            self._release(conn)
+
+    def close(self):
+        """Close every idle connection; borrowed ones close when returned."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,175 @@
+# heartbeat.py - Agent heartbeats buffered in memory and written to last_seen in batches
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from history import utc_timestamp
+
+log = logging.getLogger('computer_status.heartbeat')
+
+# Longest reported state kept, so a misbehaving agent cannot bloat the table
+MAX_STATE_LENGTH = 64
+
+
+def parse_report(report, now):
+    """(computer_id, seen_at, state) from one heartbeat report
+
+    ``timestamp`` may be epoch seconds or an ISO 8601 string (UTC unless it
+    says otherwise) and defaults to ``now``; reports from the future are
+    clamped to ``now`` so a skewed clock cannot keep a machine fresh.
+    Raises ValueError for a malformed report.
+    """
+    if not isinstance(report, dict):
+        raise ValueError('report must be an object')
+    computer_id = report.get('computer_id')
+    if not isinstance(computer_id, str) or not computer_id.strip():
+        raise ValueError('computer_id required')
+    state = report.get('state')
+    if state is not None and not isinstance(state, str):
+        raise ValueError('state must be a string')
+
+    timestamp = report.get('timestamp')
+    if timestamp is None:
+        moment = now
+    elif isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        moment = datetime.fromtimestamp(timestamp, timezone.utc)
+    elif isinstance(timestamp, str):
+        moment = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        else:
+            # Compare and store in UTC whatever offset the agent reports in
+            moment = moment.astimezone(timezone.utc)
+    else:
+        raise ValueError('timestamp must be epoch seconds or an ISO 8601 string')
+
+    return computer_id.strip(), utc_timestamp(min(moment, now)), state and state[:MAX_STATE_LENGTH]
+
+
+class HeartbeatBuffer:
+    """Absorbs heartbeats in memory and writes them to last_seen on an interval.
+
+    Request threads only update a dict keyed by computer, so any number of
+    reports from one machine between flushes cost a single row write. A
+    background thread upserts everything pending every ``flush_interval``
+    seconds in one transaction, then looks for machines that crossed the
+    ``stale_after`` threshold since the last flush. ``on_transition(stale,
+    fresh)`` is called with the computer ids that just went stale and the
+    stale ones that reported again.
+    """
+
+    def __init__(self, pool, flush_interval=1.0, stale_after=300, max_pending=100000,
+                 on_transition=None):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.stale_after = stale_after
+        self.max_pending = max_pending
+        self.on_transition = on_transition
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        # Machines already stale when we started are not announced again
+        self._last_cutoff = self.stale_cutoff()
+
+    def stale_cutoff(self):
+        """Machines last seen before this timestamp are stale"""
+        return utc_timestamp(datetime.now(timezone.utc) - timedelta(seconds=self.stale_after))
+
+    def record(self, reports):
+        """Buffer (computer_id, seen_at, state) reports; returns how many were kept
+
+        Only the newest report per computer is kept. Reports for computers
+        not already buffered are dropped once ``max_pending`` are waiting.
+        """
+        kept = 0
+        with self._lock:
+            for computer_id, seen_at, state in reports:
+                current = self._pending.get(computer_id)
+                if current is None:
+                    if len(self._pending) >= self.max_pending:
+                        continue
+                elif current[0] > seen_at:
+                    kept += 1
+                    continue
+                self._pending[computer_id] = (seen_at, state)
+                kept += 1
+        if self._thread is None:
+            self.start()
+        return kept
+
+    def start(self):
+        """Start the background flush thread"""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='heartbeat-writer', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread after writing whatever is still buffered"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        """Write buffered heartbeats and detect stale transitions; returns rows written"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        cutoff = self.stale_cutoff()
+
+        try:
+            # With nothing to write, only look for machines that went stale;
+            # an idle buffer never takes the write lock
+            with (self.pool.write() if pending else self.pool.read()) as conn:
+                revived = []
+                if pending:
+                    revived = self._stale_before(conn, list(pending), cutoff)
+                    # Only computers we know about; never move last_seen backwards
+                    conn.executemany('''
+                        INSERT INTO last_seen (computer_id, seen_at, state)
+                        SELECT ?, ?, ?
+                        WHERE EXISTS (SELECT 1 FROM computers WHERE computer_id = ?)
+                        ON CONFLICT (computer_id) DO UPDATE
+                        SET seen_at = excluded.seen_at, state = excluded.state
+                        WHERE excluded.seen_at >= last_seen.seen_at
+                    ''', ((computer_id, seen_at, state, computer_id)
+                          for computer_id, (seen_at, state) in pending.items()))
+                went_stale = [row['computer_id'] for row in conn.execute('''
+                    SELECT computer_id FROM last_seen
+                    WHERE seen_at >= ? AND seen_at < ?
+                    ORDER BY computer_id
+                ''', (self._last_cutoff, cutoff))]
+        except Exception:
+            # Put the reports back for the next attempt unless newer ones arrived
+            self.record((computer_id, seen_at, state)
+                        for computer_id, (seen_at, state) in pending.items())
+            raise
+        self._last_cutoff = cutoff
+
+        fresh = [computer_id for computer_id in revived if pending[computer_id][0] >= cutoff]
+        if self.on_transition and (went_stale or fresh):
+            self.on_transition(went_stale, fresh)
+        return len(pending)
+
+    def _stale_before(self, conn, computer_ids, cutoff):
+        """Which of ``computer_ids`` were stale before this flush"""
+        stale = []
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(computer_ids), 500):
+            chunk = computer_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            stale.extend(row['computer_id'] for row in conn.execute(f'''
+                SELECT computer_id FROM last_seen
+                WHERE computer_id IN ({placeholders}) AND seen_at < ?
+            ''', chunk + [cutoff]))
+        return stale
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log.error('heartbeat_flush_failed error=%r', e)
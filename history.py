@@ -0,0 +1,140 @@
+# history.py - Append-only status_events log written by a background thread
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# Column order of the tuples handed to HistoryWriter.record
+EVENT_COLUMNS = (
+    'computer_id', 'old_status', 'new_status', 'old_notes', 'new_notes', 'created_at', 'client'
+)
+
+log = logging.getLogger('computer_status.history')
+
+
+def utc_timestamp(moment=None):
+    """Timestamp in the same format SQLite's CURRENT_TIMESTAMP produces
+
+    Aware datetimes are converted to UTC first; naive ones are taken as UTC.
+    """
+    moment = moment or datetime.now(timezone.utc)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class HistoryWriter:
+    """Queues status events and writes them in batches (group commit).
+
+    Request threads only put tuples on a queue. A single background thread
+    wakes every ``flush_interval`` seconds (or as soon as ``batch_size``
+    events are waiting), inserts everything queued in one transaction and
+    periodically deletes events older than ``retention_days``.
+    """
+
+    def __init__(self, pool, flush_interval=1.0, batch_size=1000, retention_days=None,
+                 compact_interval=3600, max_pending=100000):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+        self.compact_interval = compact_interval
+        # Bounded so a stalled database applies backpressure instead of eating memory
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._last_compact = time.monotonic()
+
+    def record(self, events):
+        """Queue events for the next flush; starts the writer thread on first use"""
+        for event in events:
+            self._queue.put(event)
+        if self._thread is None:
+            self.start()
+
+    def start(self):
+        """Start the background writer thread"""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop the writer thread after writing whatever is still queued"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        """Write every queued event now; returns how many were written"""
+        written = 0
+        while True:
+            batch = self._drain()
+            if not batch:
+                return written
+            self._write(batch)
+            written += len(batch)
+
+    def compact(self, chunk_size=5000):
+        """Delete events older than the retention period, a chunk per transaction
+
+        Small chunks keep each delete short so request writers are not held up.
+        """
+        if not self.retention_days:
+            return 0
+        cutoff = utc_timestamp(datetime.now(timezone.utc) - timedelta(days=self.retention_days))
+        deleted = 0
+        while True:
+            with self.pool.write() as conn:
+                result = conn.execute('''
+                    DELETE FROM status_events
+                    WHERE id IN (
+                        SELECT id FROM status_events WHERE created_at < ? LIMIT ?
+                    )
+                ''', (cutoff, chunk_size))
+            deleted += result.rowcount
+            if result.rowcount < chunk_size:
+                return deleted
+
+    def _drain(self, first=None):
+        batch = [] if first is None else [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        with self.pool.write() as conn:
+            conn.executemany(f'''
+                INSERT INTO status_events ({', '.join(EVENT_COLUMNS)})
+                VALUES ({', '.join('?' * len(EVENT_COLUMNS))})
+            ''', batch)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                first = None
+            else:
+                # Give concurrent requests a moment to join this commit
+                if self._queue.qsize() < self.batch_size:
+                    self._stopping.wait(self.flush_interval)
+
+            batch = self._drain(first) if first is not None else []
+            try:
+                if batch:
+                    self._write(batch)
+                if time.monotonic() - self._last_compact >= self.compact_interval:
+                    self._last_compact = time.monotonic()
+                    deleted = self.compact()
+                    if deleted:
+                        log.info('history_compacted deleted=%d', deleted)
+            except Exception as e:
+                log.error('history_write_failed events_lost=%d error=%r', len(batch), e)
@@ -0,0 +1,188 @@
+# metrics.py - Minimal Prometheus-style metrics registry and text exposition
+import logging
+import threading
+
+# Request latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Response size buckets in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+log = logging.getLogger('computer_status.sql')
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {value}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by labels"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), state[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ('le',), key + (bound,))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {state[-1]}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+    """Holds metrics and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class DatabaseMetrics:
+    """ConnectionPool observer: lock waits, SQL time, rows, connections, slow queries"""
+
+    def __init__(self, registry, slow_query_threshold=None):
+        self.slow_query_threshold = slow_query_threshold
+        self.lock_wait = registry.histogram(
+            'db_write_lock_wait_seconds', 'Time spent waiting for the SQLite write lock (BEGIN IMMEDIATE)'
+        )
+        self.statement_time = registry.histogram(
+            'db_statement_seconds', 'Time spent executing SQL and fetching its rows', ['kind']
+        )
+        self.rows_returned = registry.counter(
+            'db_rows_returned_total', 'Rows fetched from query results'
+        )
+        self.connections_opened = registry.counter(
+            'db_connections_opened_total', 'SQLite connections opened by the pool'
+        )
+        self.slow_queries = registry.counter(
+            'db_slow_queries_total', 'Statements slower than the slow query threshold', ['kind']
+        )
+
+    def connection_opened(self):
+        self.connections_opened.inc()
+
+    def lock_waited(self, seconds):
+        self.lock_wait.observe(seconds)
+
+    def statement(self, sql, seconds, rows):
+        # Leading SQL keyword (select, update, insert, pragma, ...)
+        kind = sql.split(None, 1)[0].lower() if sql.strip() else 'empty'
+        self.statement_time.observe(seconds, kind=kind)
+        if rows:
+            self.rows_returned.inc(rows)
+        if self.slow_query_threshold is not None and seconds >= self.slow_query_threshold:
+            self.slow_queries.inc(kind=kind)
+            log.warning('slow_query seconds=%.4f rows=%d sql=%r', seconds, rows, ' '.join(sql.split()))
+
+
+# Backup duration buckets in seconds
+BACKUP_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+class BackupMetrics:
+    """BackupScheduler observer: backup time and outcome, checkpoints"""
+
+    def __init__(self, registry):
+        self.backup_time = registry.histogram(
+            'db_backup_seconds', 'Time to take an online snapshot of a site', ['site'], buckets=BACKUP_BUCKETS
+        )
+        self.backups = registry.counter(
+            'db_backups_total', 'Online snapshots by site and outcome', ['site', 'result']
+        )
+        self.backup_pages = registry.counter(
+            'db_backup_pages_total', 'Database pages copied into snapshots', ['site']
+        )
+        self.checkpoints = registry.counter(
+            'db_wal_checkpoints_total', 'WAL checkpoints by site, mode and whether they were blocked',
+            ['site', 'mode', 'result']
+        )
+        self.checkpointed_pages = registry.counter(
+            'db_wal_checkpointed_pages_total', 'WAL pages copied back into the database', ['site']
+        )
+
+    def backed_up(self, site, seconds, pages):
+        self.backup_time.observe(seconds, site=site)
+        self.backups.inc(site=site, result='ok')
+        self.backup_pages.inc(pages, site=site)
+
+    def backup_failed(self, site):
+        self.backups.inc(site=site, result='error')
+
+    def checkpointed(self, site, mode, busy, pages):
+        self.checkpoints.inc(site=site, mode=mode.lower(), result='busy' if busy else 'ok')
+        if pages > 0:
+            self.checkpointed_pages.inc(pages, site=site)
@@ -0,0 +1,330 @@
+# migrations.py - Schema versioning through PRAGMA user_version
+import logging
+import sqlite3
+
+log = logging.getLogger('computer_status.migrations')
+
+
+def table_exists(conn, name):
+    """Whether a table (or virtual table) called ``name`` exists"""
+    return conn.execute('''
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?
+    ''', (name,)).fetchone() is not None
+
+
+def add_column_if_missing(conn, table, column, definition):
+    """Add a column to an existing table that was created by an older version"""
+    columns = [row['name'] for row in conn.execute(f'PRAGMA table_info({table})')]
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def rebuild_stats(conn):
+    """Recompute status_counts from the computers table"""
+    conn.execute('DELETE FROM status_counts')
+    conn.execute('''
+        INSERT INTO status_counts (status, total)
+        SELECT status, COUNT(*) FROM computers GROUP BY status
+    ''')
+    # Cached stats (ETags) are no longer valid
+    conn.execute('UPDATE data_version SET version = version + 1')
+
+
+# Every migration below is idempotent: databases created before versioning
+# report user_version 0 but may already contain part of the schema.
+
+def create_computers(conn):
+    """Computers table"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS computers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            computer_id TEXT UNIQUE NOT NULL,
+            status TEXT DEFAULT 'pending',
+            notes TEXT DEFAULT '',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def add_change_tracking(conn):
+    """Global data version plus a per-row change_version, for ETags and delta sync"""
+    add_column_if_missing(conn, 'computers', 'change_version', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_computers_change_version
+        ON computers (change_version)
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0,
+            last_update TIMESTAMP
+        )
+    ''')
+    add_column_if_missing(conn, 'data_version', 'last_update', 'TIMESTAMP')
+    conn.execute('''
+        INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)
+    ''')
+    conn.execute('''
+        UPDATE data_version
+        SET last_update = (SELECT MAX(updated_at) FROM computers)
+        WHERE last_update IS NULL
+    ''')
+
+    # Auto-update updated_at and stamp the row with the new data version
+    # (recreated so the original updated_at-only trigger is replaced)
+    conn.execute('DROP TRIGGER IF EXISTS update_computers_timestamp')
+    conn.execute('''
+        CREATE TRIGGER update_computers_timestamp
+        AFTER UPDATE OF status, notes ON computers
+        BEGIN
+            UPDATE data_version SET version = version + 1, last_update = CURRENT_TIMESTAMP;
+            UPDATE computers
+            SET updated_at = CURRENT_TIMESTAMP,
+                change_version = (SELECT version FROM data_version)
+            WHERE id = NEW.id;
+        END
+    ''')
+    conn.execute('DROP TRIGGER IF EXISTS insert_computers_version')
+    conn.execute('''
+        CREATE TRIGGER insert_computers_version
+        AFTER INSERT ON computers
+        BEGIN
+            UPDATE data_version SET version = version + 1, last_update = CURRENT_TIMESTAMP;
+            UPDATE computers
+            SET change_version = (SELECT version FROM data_version)
+            WHERE id = NEW.id;
+        END
+    ''')
+
+
+def add_status_counts(conn):
+    """Per-status counts maintained by triggers, so stats never scan the table"""
+    stats_table_exists = table_exists(conn, 'status_counts')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS status_counts (
+            status TEXT PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    if not stats_table_exists:
+        rebuild_stats(conn)
+
+    # Plain INSERT ... WHERE NOT EXISTS rather than INSERT OR IGNORE: an outer
+    # upsert (fleet import --update) overrides a trigger's conflict policy
+    for trigger in ('status_counts_insert', 'status_counts_delete', 'status_counts_update'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    conn.execute('''
+        CREATE TRIGGER status_counts_insert
+        AFTER INSERT ON computers
+        BEGIN
+            INSERT INTO status_counts (status, total)
+            SELECT NEW.status, 0
+            WHERE NOT EXISTS (SELECT 1 FROM status_counts WHERE status IS NEW.status);
+            UPDATE status_counts SET total = total + 1 WHERE status = NEW.status;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER status_counts_delete
+        AFTER DELETE ON computers
+        BEGIN
+            UPDATE status_counts SET total = total - 1 WHERE status = OLD.status;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER status_counts_update
+        AFTER UPDATE OF status ON computers
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE status_counts SET total = total - 1 WHERE status = OLD.status;
+            INSERT INTO status_counts (status, total)
+            SELECT NEW.status, 0
+            WHERE NOT EXISTS (SELECT 1 FROM status_counts WHERE status IS NEW.status);
+            UPDATE status_counts SET total = total + 1 WHERE status = NEW.status;
+        END
+    ''')
+
+
+def add_search_indexes(conn):
+    """Indexes for filtering and keyset pagination, and FTS5 over notes
+
+    The FTS table is skipped when this SQLite build has no FTS5; notes
+    search then falls back to LIKE.
+    """
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_computers_status
+        ON computers (status, computer_id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_computers_updated_at
+        ON computers (updated_at, computer_id)
+    ''')
+
+    fts_exists = table_exists(conn, 'computers_fts')
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS computers_fts
+            USING fts5(notes, content='computers', content_rowid='id')
+        ''')
+    except sqlite3.OperationalError as e:
+        log.warning('fts_unavailable error=%r', e)
+        return
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS computers_fts_insert
+        AFTER INSERT ON computers
+        BEGIN
+            INSERT INTO computers_fts (rowid, notes) VALUES (NEW.id, NEW.notes);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS computers_fts_delete
+        AFTER DELETE ON computers
+        BEGIN
+            INSERT INTO computers_fts (computers_fts, rowid, notes) VALUES ('delete', OLD.id, OLD.notes);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS computers_fts_update
+        AFTER UPDATE OF notes ON computers
+        BEGIN
+            INSERT INTO computers_fts (computers_fts, rowid, notes) VALUES ('delete', OLD.id, OLD.notes);
+            INSERT INTO computers_fts (rowid, notes) VALUES (NEW.id, NEW.notes);
+        END
+    ''')
+    if not fts_exists:
+        conn.execute("INSERT INTO computers_fts (computers_fts) VALUES ('rebuild')")
+
+
+def add_status_events(conn):
+    """Append-only audit log of status and notes changes"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS status_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            computer_id TEXT NOT NULL,
+            old_status TEXT,
+            new_status TEXT,
+            old_notes TEXT,
+            new_notes TEXT,
+            created_at TIMESTAMP NOT NULL,
+            client TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_status_events_computer
+        ON status_events (computer_id, id)
+    ''')
+    # Time-range scans (throughput, retention); replaced by a covering
+    # index in add_throughput_index
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_status_events_time
+        ON status_events (created_at, new_status)
+    ''')
+
+
+def add_row_versions(conn):
+    """Per-row version for optimistic concurrency
+
+    Application writes now stamp updated_at, version and change_version in
+    their own UPDATE, so the trigger only bumps data_version. Writers that
+    do not stamp the row (version unchanged) still get it done for them.
+    """
+    add_column_if_missing(conn, 'computers', 'version', 'INTEGER NOT NULL DEFAULT 1')
+
+    conn.execute('DROP TRIGGER IF EXISTS update_computers_timestamp')
+    conn.execute('DROP TRIGGER IF EXISTS computers_data_version')
+    conn.execute('''
+        CREATE TRIGGER computers_data_version
+        AFTER UPDATE OF status, notes ON computers
+        WHEN NEW.version IS NOT OLD.version
+        BEGIN
+            UPDATE data_version SET version = version + 1, last_update = CURRENT_TIMESTAMP;
+        END
+    ''')
+    conn.execute('DROP TRIGGER IF EXISTS computers_stamp_row')
+    conn.execute('''
+        CREATE TRIGGER computers_stamp_row
+        AFTER UPDATE OF status, notes ON computers
+        WHEN NEW.version IS OLD.version
+        BEGIN
+            UPDATE data_version SET version = version + 1, last_update = CURRENT_TIMESTAMP;
+            UPDATE computers
+            SET updated_at = CURRENT_TIMESTAMP,
+                version = version + 1,
+                change_version = (SELECT version FROM data_version)
+            WHERE id = NEW.id;
+        END
+    ''')
+
+
+def add_last_seen(conn):
+    """When each computer's agent last reported in, and what it said"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS last_seen (
+            computer_id TEXT PRIMARY KEY,
+            seen_at TIMESTAMP NOT NULL,
+            state TEXT
+        ) WITHOUT ROWID
+    ''')
+    # Stale checks are range scans on seen_at
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_last_seen_seen_at
+        ON last_seen (seen_at)
+    ''')
+
+
+def add_throughput_index(conn):
+    """Cover the throughput query, which also filters on old_status
+
+    Without old_status in the index every event in the range was looked up
+    in the table.
+    """
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_status_events_transitions
+        ON status_events (created_at, new_status, old_status)
+    ''')
+    # Same leading columns; the new index serves every query this one did
+    conn.execute('DROP INDEX IF EXISTS idx_status_events_time')
+
+
+# Applied in order: a database at user_version N has run the first N.
+# Only ever append to this list.
+MIGRATIONS = [
+    create_computers,
+    add_change_tracking,
+    add_status_counts,
+    add_search_indexes,
+    add_status_events,
+    add_row_versions,
+    add_last_seen,
+    add_throughput_index,
+]
+
+
+def schema_version(conn):
+    """The migration number this database is at"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Apply pending migrations in the caller's transaction.
+
+    Returns the names of the migrations that ran. An up-to-date database
+    costs a single header read; otherwise the write lock is taken up front
+    (if the caller has not already) so concurrently booting workers migrate
+    one at a time.
+    """
+    if schema_version(conn) >= len(MIGRATIONS):
+        return []
+
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    # Another process may have finished while we waited for the lock
+    version = schema_version(conn)
+    applied = []
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        conn.execute(f'PRAGMA user_version = {number}')
+        applied.append(migration.__name__)
+    return applied
@@ -0,0 +1,156 @@
+# sites.py - Per-site databases: each site gets its own SQLite file, pool and writers
+import os
+import re
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+
+from changefeed import ChangeFeed, ChangeWatcher
+from db import ConnectionPool
+from heartbeat import HeartbeatBuffer
+from history import HistoryWriter
+
+# Site names end up in URLs and file names
+SITE_NAME = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def valid_site_name(name):
+    return bool(SITE_NAME.match(name or ''))
+
+
+def discover_sites(directory):
+    """Names of the site databases (``<site>.db``) already in ``directory``"""
+    if not os.path.isdir(directory):
+        return []
+    names = []
+    for filename in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(filename)
+        if extension == '.db' and valid_site_name(name):
+            names.append(name)
+    return names
+
+
+class Site:
+    """One site's database with its own pool, change feed and background writers.
+
+    Nothing is shared between sites: each has its own SQLite file and so its
+    own write lock, and a write on one site never waits for another's.
+    ``load_changes(site, after)`` reads what was committed since a data
+    version, for the change watcher.
+    """
+
+    def __init__(self, name, path, config, observer=None, load_changes=None):
+        self.name = name
+        self.path = path
+        self.pool = ConnectionPool(
+            path,
+            pragmas=config['SQLITE_PRAGMAS'],
+            max_idle=config['SQLITE_POOL_SIZE'],
+            observer=observer
+        )
+        self.feed = ChangeFeed(maxlen=config['EVENTS_BUFFER_SIZE'])
+        # Started by the first stream client
+        self.watcher = ChangeWatcher(
+            self.feed,
+            lambda after: load_changes(self, after),
+            interval=config['EVENTS_POLL_INTERVAL']
+        )
+        self.history = HistoryWriter(
+            self.pool,
+            flush_interval=config['HISTORY_FLUSH_INTERVAL'],
+            batch_size=config['HISTORY_BATCH_SIZE'],
+            retention_days=config['HISTORY_RETENTION_DAYS'],
+            compact_interval=config['HISTORY_COMPACT_INTERVAL']
+        )
+        self.heartbeats = HeartbeatBuffer(
+            self.pool,
+            flush_interval=config['HEARTBEAT_FLUSH_INTERVAL'],
+            stale_after=config['HEARTBEAT_STALE_AFTER'],
+            max_pending=config['HEARTBEAT_MAX_PENDING'],
+            on_transition=self.publish_heartbeat_transitions
+        )
+        # Set once the schema is up to date, if this SQLite build has FTS5
+        self.fts_enabled = False
+        self._closed = False
+
+    def publish_heartbeat_transitions(self, stale, fresh):
+        """Tell stream clients which computers stopped or resumed reporting"""
+        self.feed.notify({'heartbeat': {'stale': stale, 'fresh': fresh}})
+
+    def close(self):
+        """Write out whatever is buffered and close the idle connections"""
+        # Also registered with atexit; the database may be gone by then
+        if self._closed:
+            return
+        self._closed = True
+        self.watcher.stop()
+        self.history.stop()
+        self.heartbeats.stop()
+        self.pool.close()
+
+
+class SiteRegistry:
+    """The sites this process serves, plus a thread pool for queries across all of them"""
+
+    def __init__(self, workers=8):
+        self._sites = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='site-query')
+
+    def add(self, site):
+        self._sites[site.name] = site
+        return site
+
+    def get(self, name):
+        """The site called ``name``, or None"""
+        return self._sites.get(name)
+
+    def names(self):
+        return list(self._sites)
+
+    def __iter__(self):
+        return iter(list(self._sites.values()))
+
+    def __len__(self):
+        return len(self._sites)
+
+    def map(self, func):
+        """``{site name: func(site)}``, with every site run in parallel on the pool"""
+        sites = list(self._sites.values())
+        return dict(zip((site.name for site in sites), self.executor.map(func, sites)))
+
+    def close(self):
+        for site in self:
+            site.close()
+        self.executor.shutdown(wait=False)
+
+
+class ReadAhead:
+    """Chunks of rows from a cursor, the next one fetched on ``executor`` while this one is used.
+
+    Lets a merge over several sites' cursors read them all in parallel.
+    Call ``close`` before the cursor's connection goes back to its pool.
+    """
+
+    def __init__(self, executor, cursor, chunk_size):
+        self._executor = executor
+        self._cursor = cursor
+        self._chunk_size = chunk_size
+        self._future = executor.submit(cursor.fetchmany, chunk_size)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._future is None:
+            raise StopIteration
+        rows = self._future.result()
+        if not rows:
+            self._future = None
+            raise StopIteration
+        self._future = self._executor.submit(self._cursor.fetchmany, self._chunk_size)
+        return rows
+
+    def close(self):
+        """Wait out a fetch still in flight so nothing touches the connection afterwards"""
+        if self._future is not None:
+            futures.wait([self._future])
+            self._future = None